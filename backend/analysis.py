@@ -0,0 +1,290 @@
+"""Schema and typed record for the MRI analysis returned by Gemini.
+
+The analysis call runs in JSON mode against ``RESPONSE_SCHEMA``. Replies are
+validated into an ``Analysis``; minor deviations (code fences, prose around
+the object, trailing commas, Python literals, "yes"/"12 px" style values,
+coordinate lists) are repaired locally. Whatever still fails validation is
+reported by ``parse_analysis`` so the caller can make one text-only re-ask
+(``reask_prompt``) instead of re-running the whole upload and analysis.
+"""
+
+import json
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+TUMOR_TYPES = ("glioma", "meningioma", "pituitary")
+
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "tumor_detection": {
+            "type": "OBJECT",
+            "properties": {
+                "present": {"type": "BOOLEAN"},
+                "type": {"type": "STRING", "enum": list(TUMOR_TYPES), "nullable": True},
+                "location": {"type": "STRING", "nullable": True},
+                "size": {"type": "STRING", "nullable": True},
+                "characteristics": {"type": "STRING", "nullable": True},
+                "coordinates": {
+                    "type": "OBJECT",
+                    "nullable": True,
+                    "properties": {
+                        "x": {"type": "NUMBER"},
+                        "y": {"type": "NUMBER"},
+                        "z": {"type": "NUMBER"},
+                    },
+                    "required": ["x", "y", "z"],
+                },
+            },
+            "required": ["present"],
+        },
+        "gray_matter_assessment": {
+            "type": "OBJECT",
+            "properties": {
+                "loss_detected": {"type": "BOOLEAN", "nullable": True},
+                "regions_affected": {"type": "ARRAY", "items": {"type": "STRING"}},
+                "severity": {"type": "STRING", "nullable": True},
+            },
+        },
+        "other_abnormalities": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "recommended_follow_up": {"type": "ARRAY", "items": {"type": "STRING"}},
+    },
+    "required": ["tumor_detection", "gray_matter_assessment", "other_abnormalities", "recommended_follow_up"],
+}
+
+
+class AnalysisError(ValueError):
+    def __init__(self, problems):
+        super().__init__("; ".join(problems))
+        self.problems = problems
+
+
+@dataclass
+class Coordinates:
+    x: float
+    y: float
+    z: float
+
+
+@dataclass
+class TumorDetection:
+    present: bool
+    type: Optional[str] = None
+    location: Optional[str] = None
+    size: Optional[str] = None
+    characteristics: Optional[str] = None
+    coordinates: Optional[Coordinates] = None
+
+
+@dataclass
+class GrayMatterAssessment:
+    loss_detected: Optional[bool] = None
+    regions_affected: list = field(default_factory=list)
+    severity: Optional[str] = None
+
+
+@dataclass
+class Analysis:
+    tumor_detection: TumorDetection
+    gray_matter_assessment: GrayMatterAssessment = field(default_factory=GrayMatterAssessment)
+    other_abnormalities: list = field(default_factory=list)
+    recommended_follow_up: list = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def tumor_marker(self):
+        """(x, y, z) of the detected tumor, or None."""
+        coords = self.tumor_detection.coordinates
+        if not self.tumor_detection.present or coords is None:
+            return None
+        return coords.x, coords.y, coords.z
+
+
+# ----------- COERCION --------------------------------------------------------
+
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def _bool(value, name, problems):
+    if isinstance(value, bool) or value is None:
+        return value
+    text = str(value).strip().lower()
+    if text in ("true", "yes", "present", "detected", "1"):
+        return True
+    if text in ("false", "no", "absent", "none", "not detected", "0"):
+        return False
+    problems.append(f"{name} must be true or false, got {value!r}")
+    return None
+
+
+def _number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = _NUMBER_RE.search(str(value))  # "120 px", "x=120"
+    if match is None:
+        raise ValueError(value)
+    return float(match.group())
+
+
+def _text(value):
+    if value is None or isinstance(value, str):
+        return value or None
+    return json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+
+
+def _strings(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value] if value.strip() and value.strip().lower() != "none" else []
+    if isinstance(value, dict):
+        return [f"{k}: {v}" for k, v in value.items()]
+    return [_text(v) for v in value if v not in (None, "")]
+
+
+def _coordinates(value, problems):
+    # Coordinates are nullable: "not determinable" and the like mean none.
+    if value in (None, "", {}, []) or not _NUMBER_RE.search(str(value)):
+        return None
+    try:
+        if isinstance(value, dict):
+            lowered = {str(k).lower(): v for k, v in value.items()}
+            return Coordinates(*(_number(lowered[k]) for k in ("x", "y", "z")))
+        values = _NUMBER_RE.findall(value) if isinstance(value, str) else value
+        if len(values) == 3:
+            return Coordinates(*(_number(v) for v in values))
+    except (KeyError, TypeError, ValueError):
+        pass
+    problems.append(f"tumor_detection.coordinates must be {{x, y, z}} numbers, got {value!r}")
+    return None
+
+
+def _tumor_type(value):
+    text = _text(value)
+    if not text:
+        return None
+    lowered = text.lower()
+    return next((t for t in TUMOR_TYPES if t in lowered), text)
+
+
+def analysis_from_dict(data) -> Analysis:
+    """Validate and coerce a decoded reply. Raises AnalysisError listing
+    every problem that could not be coerced."""
+    if not isinstance(data, dict):
+        raise AnalysisError([f"expected a JSON object, got {type(data).__name__}"])
+    problems = []
+
+    detection = data.get("tumor_detection")
+    if not isinstance(detection, dict):
+        problems.append("tumor_detection object is missing")
+        detection = {}
+    if detection.get("present") is None:
+        problems.append("tumor_detection.present is missing")
+    present = _bool(detection.get("present"), "tumor_detection.present", problems)
+
+    gray = data.get("gray_matter_assessment")
+    if isinstance(gray, str):  # prose instead of an object
+        gray = {"severity": gray}
+    gray = gray if isinstance(gray, dict) else {}
+    loss = _bool(gray.get("loss_detected"), "gray_matter_assessment.loss_detected", problems)
+
+    record = Analysis(
+        tumor_detection=TumorDetection(
+            present=bool(present),
+            type=_tumor_type(detection.get("type")) if present else None,
+            location=_text(detection.get("location")),
+            size=_text(detection.get("size")),
+            characteristics=_text(detection.get("characteristics")),
+            coordinates=_coordinates(detection.get("coordinates"), problems) if present else None,
+        ),
+        gray_matter_assessment=GrayMatterAssessment(
+            loss_detected=loss,
+            regions_affected=_strings(gray.get("regions_affected")),
+            severity=_text(gray.get("severity")),
+        ),
+        other_abnormalities=_strings(data.get("other_abnormalities")),
+        recommended_follow_up=_strings(data.get("recommended_follow_up")),
+    )
+    if problems:
+        raise AnalysisError(problems)
+    return record
+
+
+# ----------- PARSING ---------------------------------------------------------
+
+# JSON strings and the single-quoted strings of Python's repr; repairs
+# never touch text inside either.
+_STRINGS = r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\''
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def _outside_strings(pattern, repl, text):
+    """``re.sub(pattern, repl, text)`` skipping quoted strings."""
+    return re.sub(
+        f"{_STRINGS}|{pattern}",
+        lambda m: m.group() if m.group()[0] in "\"'" else repl(m),
+        text,
+    )
+
+
+def _repair_text(raw: str) -> str:
+    """Best-effort syntactic fixes for almost-JSON."""
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", raw.strip())
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        text = text[start:end + 1]  # drop prose around the object
+    text = _outside_strings(r"//[^\n]*", lambda m: "", text)
+    text = _outside_strings(r",(\s*[}\]])", lambda m: m.group(1), text)  # trailing commas
+    return _outside_strings(r"\b(True|False|None)\b", lambda m: _LITERALS[m.group(1)], text)
+
+
+def _double_quote(text: str) -> str:
+    """Rewrite single-quoted strings (Python's repr) as JSON strings."""
+    return re.sub(
+        _STRINGS,
+        lambda m: m.group() if m.group()[0] == '"' else json.dumps(m.group()[1:-1].replace("\\'", "'")),
+        text,
+    )
+
+
+def parse_analysis(raw: str):
+    """Returns (Analysis, repaired) where ``repaired`` says whether local
+    fixes were needed. Raises AnalysisError when the reply is unusable."""
+    try:
+        return analysis_from_dict(json.loads(raw)), False
+    except (json.JSONDecodeError, AnalysisError):
+        pass
+    text = _repair_text(raw)
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        try:  # single-quoted keys and strings, as Python's repr writes them
+            data = json.loads(_double_quote(text))
+        except json.JSONDecodeError as e:
+            raise AnalysisError([f"reply is not valid JSON ({e.msg} at line {e.lineno} column {e.colno})"])
+    return analysis_from_dict(data), True
+
+
+def reask_prompt(error: AnalysisError, raw: str) -> str:
+    """Text-only repair request: the rejected reply plus what is wrong
+    with it. The findings are already in the reply, so no image is needed."""
+    return (
+        "This MRI analysis reply could not be used: " + "; ".join(error.problems) + ".\n"
+        "Rewrite it as the JSON object described by the response schema, "
+        "keeping its findings and adding nothing new.\n\nReply:\n" + raw
+    )
+
+
+def tumor_marker(context):
+    """(x, y, z) from a stored context, including ones saved before the
+    schema existed; None when there is no usable tumor position."""
+    try:
+        return analysis_from_dict(context).tumor_marker()
+    except AnalysisError:
+        detection = context.get("tumor_detection") if isinstance(context, dict) else None
+        if not isinstance(detection, dict) or not detection.get("present"):
+            return None
+        coords = _coordinates(detection.get("coordinates"), [])
+        return (coords.x, coords.y, coords.z) if coords else None
@@ -1,31 +1,63 @@
-from flask import Flask, request, jsonify
+from flask import (
+    Flask, Response, request, jsonify, send_from_directory, abort, g,
+    stream_with_context,
+)
 from flask_cors import CORS
 from pathlib import Path
-from datetime import datetime
-from operator import itemgetter
+from datetime import datetime, timezone
 import google.generativeai as genai
-import boto3
+import contextvars
+import hashlib
+import io
 import json
 import os
-import re
 import shutil
+import sqlite3
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
-from botocore.exceptions import NoCredentialsError
+
+from analysis import (
+    RESPONSE_SCHEMA, Analysis, AnalysisError, GrayMatterAssessment, TumorDetection,
+    parse_analysis, reask_prompt, tumor_marker,
+)
+from cache import Coalescer, LRUCache
+from catalog import Catalog
+from gateway import ModelGateway, ModelUnavailable
+from ingest import InvalidImage, is_series_archive, make_thumbnail, normalize_image, normalize_series
+from jobs import JobQueue, QueueFull
+from metrics import registry, render as render_metrics, server_timing_header, span
+from prescreen import MODEL_PATH as PRESCREEN_DEFAULT_MODEL, Prescreener
+from run_ids import (
+    HISTORY_PREFIX, TIMESTAMP_RE, history_key, history_key_timestamp, new_run_id, run_time,
+    search_bound,
+)
+from sessions import ChatSessions, compact_json
+from slices import SliceRenderer
+from storage import LocalStorage, get_storage
+from viewer_pool import ViewerLimit, ViewerPool
 
 # ----------- CONFIG ----------------------------------------------------------
-import subprocess
-import sys
-from threading import Thread
+import atexit
+import shlex
+from threading import Lock
 
 UPLOAD_FOLDER = "/tmp/uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Job uploads must outlive a restart, so they are kept next to the job DB.
+JOB_DIR = Path(os.environ.get("JOB_DIR", Path(__file__).parent / "jobs_data"))
+JOB_UPLOAD_FOLDER = JOB_DIR / "uploads"
+JOB_UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
+
 
 def load_env():
     """Populate os.environ from .env.local (simple line-by-line parser)."""
     env_path = Path(__file__).parent.parent / ".env.local"
     if not env_path.exists():
+        if "GOOGLE_API_KEY" in os.environ:
+            return  # already configured by the process environment
         raise FileNotFoundError(f"Environment file not found: {env_path}")
 
     for line in env_path.read_text().splitlines():
@@ -39,8 +71,32 @@ load_env()  # must run before we touch env vars
 
 genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
 
-S3_BUCKET = os.environ["S3_BUCKET_NAME"]
-AWS_REGION = os.environ["AWS_REGION"]
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+
+# sha256 of the uploaded bytes -> the run that already analyzed them.
+HASH_INDEX_PREFIX = "index/hashes/"
+
+# sync: summarize before /analyze_mri returns. background: return once the
+# context is stored and summarize afterwards. lazy: summarize on first
+# /history (or duplicate-upload) access.
+SUMMARY_MODE = os.environ.get("SUMMARY_MODE", "sync")
+
+# Local SQLite catalog of runs and their findings, queried by /search.
+CATALOG_DB = Path(os.environ.get("CATALOG_DB", Path(__file__).parent / "catalog_data" / "catalog.sqlite3"))
+SEARCH_MAX_LIMIT = 500
+
+# History thumbnails are generated at ingest and stored as thumb_<ts>.jpg.
+THUMBNAIL_EDGE = int(os.environ.get("THUMBNAIL_EDGE", 256))
+THUMBNAIL_QUALITY = int(os.environ.get("THUMBNAIL_QUALITY", 80))
+
+# Image URLs handed to clients are presigned for PRESIGN_TTL seconds. They
+# are re-signed once per half TTL (a "signing epoch"), so a URL a client has
+# cached stays valid for at least PRESIGN_TTL / 2.
+PRESIGN_TTL = int(os.environ.get("PRESIGN_TTL", 3600))
+
+# Pointer to the newest run, so requests without a timestamp skip listing.
+LATEST_KEY = "index/latest.json"
 
 generation_config = dict(
     temperature=0.4,
@@ -49,10 +105,76 @@ generation_config = dict(
     max_output_tokens=8192,
 )
 
+# Images up to this size are sent inline with the prompt; larger ones go
+# through the Files API, whose processing state has to be polled.
+INLINE_IMAGE_MAX_BYTES = int(os.environ.get("INLINE_IMAGE_MAX_BYTES", 4 * 1024 * 1024))
+FILE_POLL_INITIAL = 0.2
+FILE_POLL_MAX = 2.0
+FILE_POLL_TIMEOUT = float(os.environ.get("GEMINI_FILE_TIMEOUT", 120))
+
+# Gemini gets a downscaled, metadata-free JPEG; the archive keeps the original.
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", 1024))
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", 85))
+# Zipped DICOM series: only this many of the most informative slices are sent.
+SERIES_TOP_K = int(os.environ.get("SERIES_TOP_K", 6))
+
+# Local CPU classifier run before Gemini (see prescreen.py). With the fast
+# path on, confident notumor scans are answered without a model call.
+PRESCREEN_MODEL = Path(os.environ.get("PRESCREEN_MODEL", PRESCREEN_DEFAULT_MODEL))
+PRESCREEN_FAST_PATH = os.environ.get("PRESCREEN_FAST_PATH", "0") == "1"
+PRESCREEN_FAST_PATH_CONFIDENCE = float(os.environ.get("PRESCREEN_FAST_PATH_CONFIDENCE", 0.98))
+FAST_PATH_SUMMARY = (
+    "No tumor detected by the local pre-screen; the scan was not sent for a "
+    "full AI analysis."
+)
+
+# DICOM series browsed through /scans/<scan>/...; each is loaded once and
+# kept in a small volume cache, rendered PNG tiles in a larger one.
+SCANS_DIR = Path(os.environ.get("SCANS_DIR", Path(__file__).parent / "scans"))
+SCAN_CACHE_SIZE = int(os.environ.get("SCAN_CACHE_SIZE", 4))
+TILE_CACHE_SIZE = int(os.environ.get("TILE_CACHE_SIZE", 1024))
+
+# /run-viewer keeps VIEWER_POOL_WARM napari processes pre-imported and allows
+# at most VIEWER_MAX_OPEN windows. VIEWER_ARGS is passed to each viewer.py.
+VIEWER_POOL_WARM = int(os.environ.get("VIEWER_POOL_WARM", 1))
+VIEWER_MAX_OPEN = int(os.environ.get("VIEWER_MAX_OPEN", 2))
+VIEWER_ARGS = shlex.split(os.environ.get("VIEWER_ARGS", ""))
+
+# Every Gemini call goes through this gateway (see gateway.py). 0 disables
+# the per-minute limits.
+gateway = ModelGateway(
+    rpm=int(os.environ.get("GEMINI_RPM", 60)),
+    tpm=int(os.environ.get("GEMINI_TPM", 1_000_000)),
+    max_in_flight=int(os.environ.get("GEMINI_MAX_IN_FLIGHT", 8)),
+    max_retries=int(os.environ.get("GEMINI_MAX_RETRIES", 4)),
+    max_wait=float(os.environ.get("GEMINI_MAX_WAIT", 60)),
+)
+
 model = genai.GenerativeModel(
     model_name="gemini-2.0-flash",
     generation_config=generation_config,
 )
+# The scan analysis is answered in JSON mode against analysis.RESPONSE_SCHEMA.
+analysis_model = genai.GenerativeModel(
+    model_name="gemini-2.0-flash",
+    generation_config={
+        **generation_config,
+        "response_mime_type": "application/json",
+        "response_schema": RESPONSE_SCHEMA,
+    },
+)
+
+registry.describe("analysis_parse_total", "Analysis replies by outcome: valid, repaired, reasked or failed.")
+
+
+def load_prescreener():
+    if not PRESCREEN_MODEL.exists():
+        print(f"Pre-screen model not found at {PRESCREEN_MODEL}; run prescreen.py train")
+        return None
+    return Prescreener.load(PRESCREEN_MODEL)
+
+
+prescreener = load_prescreener()
 
 
 # ----------- FLASK APP -------------------------------------------------------
@@ -63,159 +185,616 @@ CORS(app)
 
 # ----------- HELPERS ---------------------------------------------------------
 
-def s3_client():
-    return boto3.client(
-        "s3",
-        aws_access_key_id=os.environ["AWS_ACCESS_KEY"],
-        aws_secret_access_key=os.environ["AWS_SECRET_KEY"],
-        region_name=AWS_REGION,
-    )
-
-
 def upload_to_gemini(path, mime_type=None):
-    file = genai.upload_file(path, mime_type=mime_type)
-    print(f"Uploading to Gemini: {path}")
+    """``path`` may be a filesystem path or a binary file object."""
+    def upload():
+        if hasattr(path, "seek"):
+            path.seek(0)  # a retried upload must resend from the start
+        return genai.upload_file(path, mime_type=mime_type)
+
+    file = gateway.call(upload, kind="upload", tokens=0)
+    print(f"Uploading to Gemini: {getattr(path, 'name', path)}")
     return file
 
 
-def wait_for_files_active(files):
+def wait_for_files_active(files, timeout=FILE_POLL_TIMEOUT):
+    """Poll until every file is ACTIVE, backing off from FILE_POLL_INITIAL
+    up to FILE_POLL_MAX seconds between checks."""
     print("Waiting for Gemini file processing…")
+    deadline = time.monotonic() + timeout
     for f in files:
+        delay = FILE_POLL_INITIAL
         while (state := genai.get_file(f.name).state.name) == "PROCESSING":
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(f"File {f.name} still processing after {timeout}s")
             print(".", end="", flush=True)
-            time.sleep(5)
+            time.sleep(delay)
+            delay = min(delay * 2, FILE_POLL_MAX)
         if state != "ACTIVE":
             raise RuntimeError(f"File {f.name} failed (state={state})")
     print(" ready")
 
 
+def image_part(data: bytes, mime_type: str, timings: dict = None):
+    """Prompt part for an image: inline bytes when small, else a Files API upload."""
+    if len(data) <= INLINE_IMAGE_MAX_BYTES:
+        return {"mime_type": mime_type, "data": data}
+    with span("gemini_upload", timings):
+        img_file = upload_to_gemini(io.BytesIO(data), mime_type=mime_type)
+    with span("file_wait", timings):
+        wait_for_files_active([img_file])
+    return img_file
+
+
+def write_history_manifest(store, ts: str, image_key: str, summary, **extra):
+    """Store the lightweight record the History tab renders for one run.
+    ``summary`` is None while it is still being generated. URLs are not
+    stored: they are presigned when the manifest is served."""
+    manifest = {
+        "timestamp": ts,
+        "summary": summary,
+        "image_file": image_key,
+        "json_file": f"saved/{ts}/context_{ts}.json",
+        **extra,
+    }
+    store.put(history_key(ts), json.dumps(manifest), "application/json")
+    return manifest
+
+
+# Assembled /history pages, keyed by their ETag.
+history_page_cache = LRUCache(maxsize=int(os.environ.get("HISTORY_PAGE_CACHE_SIZE", 64)))
+signed_url_cache = LRUCache(maxsize=int(os.environ.get("SIGNED_URL_CACHE_SIZE", 4096)))
+
+
+def signing_epoch() -> int:
+    return int(time.time() // max(1, PRESIGN_TTL // 2))
+
+
+def signing_epoch_start() -> datetime:
+    """When the current URLs were signed, as far as Last-Modified goes."""
+    return datetime.fromtimestamp(signing_epoch() * max(1, PRESIGN_TTL // 2), tz=timezone.utc)
+
+
+def signed_url(key: str) -> str:
+    """Presigned URL for ``key``, identical for the whole signing epoch so
+    responses that embed it keep a stable ETag."""
+    cache_key = (key, signing_epoch())
+    url = signed_url_cache.get(cache_key)
+    if url is None:
+        url = get_storage().signed_url(key, PRESIGN_TTL)
+        signed_url_cache.set(cache_key, url)
+    return url
+
+
+def history_item(manifest) -> dict:
+    """A manifest as /history serves it. Runs stored before thumbnails
+    existed show their full image."""
+    item = {k: v for k, v in manifest.items() if k not in ("mri_url", "thumbnail_url")}
+    item["mri_url"] = signed_url(manifest["image_file"])
+    item["thumbnail_url"] = signed_url(manifest.get("thumbnail_file") or manifest["image_file"])
+    return item
+
+
+# Contexts never change once written, so they only leave the cache when
+# it is full or the TTL passes. The latest-run pointer gets a short TTL so
+# other worker processes' runs show up quickly.
+context_cache = LRUCache(
+    maxsize=int(os.environ.get("CONTEXT_CACHE_SIZE", 256)),
+    ttl=float(os.environ.get("CONTEXT_CACHE_TTL", 3600)),
+)
+latest_cache = LRUCache(maxsize=1, ttl=float(os.environ.get("LATEST_TTL", 30)))
+_latest_lock = Lock()
+
+
+def run_image_file(store, ts: str) -> str:
+    """Key of the run's image. Originals keep their own extension, so it is
+    read from the history manifest rather than guessed."""
+    try:
+        with span("storage_get_manifest"):
+            return json.loads(store.get(history_key(ts)))["image_file"]
+    except (FileNotFoundError, KeyError):
+        return f"saved/{ts}/mri_{ts}.jpg"  # runs archived before manifests
+
+
 def get_analysis_by_timestamp(ts: str):
     """Return context + MRI URL for a given timestamp folder."""
-    cli = s3_client()
-    ctx_key = f"saved/{ts}/context_{ts}.json"
-    mri_key = f"saved/{ts}/mri_{ts}.jpg"
+    cached = context_cache.get(ts)
+    if cached is None:
+        store = get_storage()
+        ctx_key = f"saved/{ts}/context_{ts}.json"
 
-    ctx_obj = cli.get_object(Bucket=S3_BUCKET, Key=ctx_key)
-    context = json.loads(ctx_obj["Body"].read())
+        with span("storage_get_context"):
+            context = json.loads(store.get(ctx_key))
 
+        cached = {"context": context, "image_file": run_image_file(store, ts)}
+        context_cache.set(ts, cached)
     return {
-        "context": context,
-        "mri_url": f"https://{S3_BUCKET}.s3.amazonaws.com/{mri_key}",
+        "context": cached["context"],
+        "mri_url": signed_url(cached["image_file"]),
         "timestamp": ts,
     }
 
 
+def set_latest_run(store, ts: str):
+    """Advance the latest-run pointer (never backwards within this process)."""
+    with _latest_lock:
+        current = latest_cache.get("ts")
+        if current and current > ts:
+            return
+        latest_cache.set("ts", ts)
+        store.put(LATEST_KEY, json.dumps({"timestamp": ts}), "application/json")
+
+
+def get_latest_timestamp():
+    ts = latest_cache.get("ts")
+    if ts:
+        return ts
+
+    store = get_storage()
+    try:
+        with span("storage_get_latest"):
+            ts = json.loads(store.get(LATEST_KEY))["timestamp"]
+    except FileNotFoundError:
+        # No pointer yet (archive predates it): the history index is
+        # newest-first, so its first key names the latest run.
+        with span("storage_list"):
+            objs, _ = store.list(HISTORY_PREFIX, max_keys=1)
+        if not objs:
+            return None
+        ts = history_key_timestamp(objs[0]["Key"])
+    latest_cache.set("ts", ts)
+    return ts
+
+
 def get_latest_analysis():
     """Fallback when no timestamp is provided."""
-    cli = s3_client()
-    objs = cli.list_objects_v2(Bucket=S3_BUCKET, Prefix="saved/")
-    if "Contents" not in objs:
+    ts = get_latest_timestamp()
+    return get_analysis_by_timestamp(ts) if ts else None
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_run_by_hash(digest: str):
+    """Return the stored result for previously analyzed bytes, or None."""
+    store = get_storage()
+    try:
+        record = json.loads(store.get(f"{HASH_INDEX_PREFIX}{digest}.json"))
+    except FileNotFoundError:
+        return None
+    ts = record["timestamp"]
+    return {
+        **record,
+        "image_url": signed_url(record["image_file"]),
+        "message": "Scan already analyzed; returning existing results",
+        "cached": True,
+        "context": get_analysis_by_timestamp(ts)["context"],
+        "summary": ensure_summary(ts)["summary"],
+    }
+
+
+# Concurrent summaries and scans of the same run/bytes share one piece of work.
+in_flight = Coalescer()
+
+
+def run_prescreen(images, timings: dict = None):
+    """Pre-screen output for the image(s) of one scan, or None if unavailable."""
+    if prescreener is None:
         return None
+    try:
+        with span("prescreen", timings):
+            return prescreener.predict([i.data for i in images])
+    except Exception as e:
+        print("Pre-screen failed:", e)
+        return None
+
 
-    ctx_files = [o for o in objs["Contents"] if "context_" in o["Key"]]
-    if not ctx_files:
+def prescreen_file(path: Path):
+    """Pre-screen an uploaded file as-is (used for job priority)."""
+    data = path.read_bytes()
+    if prescreener is None or is_series_archive(data):
+        return None
+    try:
+        with span("prescreen"):
+            return prescreener.predict(data)
+    except Exception as e:
+        print("Pre-screen failed:", e)
         return None
 
-    latest_ctx = max(ctx_files, key=itemgetter("LastModified"))
-    ts = latest_ctx["Key"].split("context_")[1].split(".json")[0]
-    return get_analysis_by_timestamp(ts)
+
+def is_fast_path(prescreen) -> bool:
+    return bool(
+        PRESCREEN_FAST_PATH
+        and prescreen
+        and prescreen["label"] == "notumor"
+        and prescreen["confidence"] >= PRESCREEN_FAST_PATH_CONFIDENCE
+    )
+
+
+def fast_path_analysis(prescreen) -> dict:
+    record = Analysis(
+        tumor_detection=TumorDetection(present=False),
+        gray_matter_assessment=GrayMatterAssessment(severity="Not assessed (answered by the local pre-screen)."),
+        recommended_follow_up=["Request a full analysis if clinical suspicion remains."],
+    )
+    return {**record.to_dict(), "source": "prescreen", "prescreen_confidence": prescreen["confidence"]}
+
+
+def summarize_analysis(analysis_json) -> str:
+    sum_prompt = (
+        "Summarize this analysis (2–3 sentences):\n"
+        + json.dumps(analysis_json, indent=2)
+    )
+    key = ("summary", hashlib.sha256(sum_prompt.encode()).hexdigest())
+    return gateway.send(model.start_chat(), sum_prompt, kind="summary", key=key).text.strip()
+
+
+def ensure_summary(ts: str):
+    """Return the run's manifest, generating and storing its summary first if
+    it was deferred (SUMMARY_MODE=background/lazy)."""
+    store = get_storage()
+    manifest = json.loads(store.get(history_key(ts)))
+    if manifest.get("summary") is not None:
+        return manifest
+
+    def fill():
+        current = json.loads(store.get(history_key(ts)))
+        if current.get("summary") is None:
+            context = json.loads(store.get(current["json_file"]))
+            current["summary"] = summarize_analysis(context)
+            summary_key = current.get("summary_file", f"saved/{ts}/summary_{ts}.txt")
+            store.put(summary_key, current["summary"], "text/plain")
+            store.put(history_key(ts), json.dumps(current), "application/json")
+            catalog.set_summary(ts, current["summary"])
+        return current
+
+    return in_flight.run(("summary", ts), fill)[0]
 
 
 # ----------- CORE PROCESSING -------------------------------------------------
 
+# Runs the storage puts and summary call that follow an analysis.
+post_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("POST_PROCESS_WORKERS", 8)),
+    thread_name_prefix="post-analysis",
+)
+
+
+def log_background_failure(future, what):
+    """Done-callback for fire-and-forget work, whose errors nobody awaits."""
+    error = future.exception()
+    if error is not None:
+        print(f"{what} failed: {type(error).__name__}: {error}")
+
+
+def submit_post(fn, *args):
+    """Run ``fn`` on the post-analysis pool inside the caller's context, so
+    its spans still reach the current request's Server-Timing header."""
+    return post_pool.submit(contextvars.copy_context().run, fn, *args)
+
+
 def process_mri_scan(image_path: Path):
-    """Analyze scan, upload JSON/image/summary. Returns dict to frontend."""
+    """Analyze scan, upload JSON/image/summary. Returns dict to frontend,
+    including the analysis context that was stored for the run.
+
+    Identical bytes are analyzed once: repeats are answered from the hash
+    index and concurrent duplicates wait on the in-flight run.
+    """
     if not image_path.exists():
         return {"error": f"File not found: {image_path}"}
 
-    # ── Upload to Gemini & run analysis ──────────────────────────────────────
-    img_file = upload_to_gemini(str(image_path), mime_type="image/jpeg")
-    wait_for_files_active([img_file])
-
-    chat = model.start_chat()
-    analysis_prompt = """
-    Please analyze this MRI brain scan image and provide:
+    with span("hash"):
+        digest = file_sha256(image_path)
+    cached = get_run_by_hash(digest)
+    if cached:
+        return cached
+
+    # Another request may finish between the lookup and in_flight.run(), so the
+    # owner checks the index once more before paying for an analysis.
+    result, shared = in_flight.run(
+        ("scan", digest),
+        lambda: get_run_by_hash(digest) or analyze_and_store(image_path, digest),
+    )
+    return {**result, "coalesced": True} if shared else result
+
+
+def gemini_analysis(images, series, timings: dict):
+    """Send the image(s) to Gemini; returns (analysis, raw) with analysis None
+    when the reply is still unusable after local repair and one re-ask."""
+    parts = [image_part(i.data, i.mime_type, timings) for i in images]
+
+    chat = analysis_model.start_chat()
+    dims = "x=401, y=200, z=300"
+    intro = "Please analyze this MRI brain scan image and provide:"
+    if series:
+        z, y, x = series.shape
+        dims = f"x={x}, y={y}, z={z}"
+        intro = (
+            f"These {len(images)} images are axial slices z={series.slice_indices} "
+            f"of one MRI series with {z} slices; analyze them together as one "
+            "brain scan and provide:"
+        )
+    analysis_prompt = f"""
+    {intro}
 
-        1. Detection of any visible brain tumors (location, size, characteristics) and what type they are (glioma, meningioma, pituitary). The image may not have a tumor at all. If there is a tumor, give me the predicted X Y Z coordinates of where it is located. The dimensions of the scan are x=401, y=200, z=300.
+        1. Detection of any visible brain tumors (location, size, characteristics) and what type they are (glioma, meningioma, pituitary). The image may not have a tumor at all. If there is a tumor, give me the predicted X Y Z coordinates of where it is located. The dimensions of the scan are {dims}.
         2. Assessment of gray matter loss or abnormalities (regions affected, severity). There may not be any gray matter loss at all.
         3. Other notable abnormalities (if present)
         4. Recommended follow-up actions based on findings
 
-        Be very brief in analysis but accurate. Output your analysis as a JSON object only, without extra text or code block formatting.
+        Be very brief in analysis but accurate. Answer with the JSON object described by the response schema.
     """
-    raw = chat.send_message([img_file, analysis_prompt]).text.strip()
-    clean = re.sub(r"^```(?:json)?\n|\n```$", "", raw)
+    with span("analysis", timings):
+        raw = gateway.send(chat, [*parts, analysis_prompt], kind="analysis").text.strip()
 
     try:
-        analysis_json = json.loads(clean)
-    except json.JSONDecodeError:
-        return {"error": "Gemini response is not valid JSON", "raw_response": raw}
+        with span("json_parse", timings):
+            record, repaired = parse_analysis(raw)
+        registry.inc("analysis_parse_total", outcome="repaired" if repaired else "valid")
+        return record.to_dict(), raw
+    except AnalysisError as e:
+        error = e
+    # A fresh chat holding only the rejected reply: the analysis chat's
+    # history would resend the images with it.
+    print(f"Analysis reply unusable ({error}); asking once more")
+    with span("analysis_reask", timings):
+        raw = gateway.send(
+            analysis_model.start_chat(), reask_prompt(error, raw), kind="analysis_reask"
+        ).text.strip()
+    try:
+        record, _ = parse_analysis(raw)
+    except AnalysisError as e:
+        print(f"Analysis reply still unusable after re-ask: {e}")
+        registry.inc("analysis_parse_total", outcome="failed")
+        return None, raw
+    registry.inc("analysis_parse_total", outcome="reasked")
+    return record.to_dict(), raw
+
+
+def analyze_and_store(image_path: Path, digest: str):
+    """Run the Gemini pipeline for one image and archive the results."""
+    timings = {}
+    try:
+        with span("process_mri_scan", timings):
+            return _analyze_and_store(image_path, digest, timings)
+    finally:
+        print(f"process_mri_scan timings (ms): {timings}")
+
+
+def _analyze_and_store(image_path: Path, digest: str, timings: dict):
+    # ── Send to Gemini & run analysis ────────────────────────────────────────
+    with span("normalize", timings):
+        original = image_path.read_bytes()
+        series = None
+        if is_series_archive(original):
+            normalized = series = normalize_series(
+                original, SERIES_TOP_K, IMAGE_MAX_EDGE, IMAGE_JPEG_QUALITY
+            )
+            images = series.images
+        else:
+            normalized = normalize_image(original, IMAGE_MAX_EDGE, IMAGE_JPEG_QUALITY)
+            images = [normalized]
+    print(
+        f"Normalized {len(original)} B -> {sum(len(i.data) for i in images)} B "
+        f"in {len(images)} image(s) ({images[0].width}x{images[0].height})"
+    )
+    prescreen = run_prescreen(images, timings)
+    fast_path = is_fast_path(prescreen)
+    if fast_path:
+        analysis_json = fast_path_analysis(prescreen)
+    else:
+        analysis_json, raw = gemini_analysis(images, series, timings)
+        if analysis_json is None:
+            return {"error": "Gemini response did not match the analysis schema", "raw_response": raw}
 
     # ── Timestamped folder name ─────────────────────────────────────────────
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    ts = new_run_id()
     folder = f"saved/{ts}/"
     json_name = f"context_{ts}.json"
-    img_ext = image_path.suffix or ".jpg"
+    img_ext = normalized.original_extension
     img_name = f"mri_{ts}{img_ext}"
     sum_name = f"summary_{ts}.txt"
 
-    cli = s3_client()
+    store = get_storage()
+    context_key = folder + json_name
+    image_key = folder + img_name
+    image_body = (original, normalized.original_mime_type)
+    thumb_key = folder + f"thumb_{ts}.jpg"
+    thumb_source = images[0].data  # normalized JPEG: cheap to shrink further
+    if series:
+        # The zip is kept as series_<ts>.zip; the best-scoring slice stands in
+        # as the run's image for history and chat.
+        best = max(range(len(images)), key=lambda i: series.scores[i])
+        image_key = folder + f"mri_{ts}.jpg"
+        image_body = (images[best].data, "image/jpeg")
+        thumb_source = images[best].data
+        series_key = folder + f"series_{ts}{img_ext}"
+        analysis_json["series"] = {
+            "shape": dict(zip(("z", "y", "x"), series.shape)),
+            "selected_slices": series.slice_indices,
+            "slice_scores": series.scores,
+            "archive_file": series_key,
+        }
+
+    def put_context():
+        with span("put_context", timings):
+            store.put(context_key, json.dumps(analysis_json, indent=4), "application/json")
+
+    def put_image():
+        with span("put_image", timings):
+            store.put(image_key, *image_body)
+            if series:
+                store.put(series_key, original, series.original_mime_type)
+
+    def put_thumbnail():
+        with span("thumbnail", timings):
+            thumb = make_thumbnail(thumb_source, THUMBNAIL_EDGE, THUMBNAIL_QUALITY)
+        with span("put_thumbnail", timings):
+            store.put(thumb_key, thumb, "image/jpeg")
+
+    def put_prescreen():
+        with span("put_prescreen", timings):
+            store.put(folder + f"prescreen_{ts}.json", json.dumps(prescreen), "application/json")
+
+    def summarize():
+        with span("summary", timings):
+            summary = FAST_PATH_SUMMARY if fast_path else summarize_analysis(analysis_json)
+        with span("put_summary", timings):
+            store.put(folder + sum_name, summary, "text/plain")
+        return summary
+
+    # The archive puts and the summary call are independent; only the summary
+    # may be deferred, since /chat and /history need the context and image.
+    stages = [submit_post(put_context), submit_post(put_image), submit_post(put_thumbnail)]
+    if prescreen:
+        stages.append(submit_post(put_prescreen))
+    # A fast-path summary is free, so it is never deferred.
+    summary_stage = submit_post(summarize) if SUMMARY_MODE == "sync" or fast_path else None
+    for stage in stages:
+        stage.result()
+    summary = summary_stage.result() if summary_stage else None
+
+    result = {
+        "message": "Files uploaded successfully",
+        "timestamp": ts,
+        "json_file": context_key,
+        "image_file": image_key,
+        "image_url": signed_url(image_key),
+        "thumbnail_file": thumb_key,
+        "summary_file": folder + sum_name,
+    }
+    if series:
+        result["selected_slices"] = series.slice_indices
+    if prescreen:
+        result["prescreen"] = prescreen
+        result["fast_path"] = fast_path
+
+    # History manifest + hash index (written last so they only list complete runs)
+    with span("put_indexes", timings):
+        extra = {"prescreen": {k: prescreen[k] for k in ("label", "confidence")}} if prescreen else {}
+        write_history_manifest(
+            store, ts, image_key, summary,
+            summary_file=folder + sum_name, thumbnail_file=thumb_key, **extra
+        )
+        store.put(
+            f"{HASH_INDEX_PREFIX}{digest}.json",
+            json.dumps({**result, "sha256": digest}),
+            "application/json",
+        )
+
+    with span("catalog", timings):
+        catalog_run(ts, analysis_json, digest, summary, image_key, context_key, prescreen)
 
-    # JSON
-    cli.put_object(
-        Bucket=S3_BUCKET,
-        Key=folder + json_name,
-        Body=json.dumps(analysis_json, indent=4),
-        ContentType="application/json",
-    )
+    context_cache.set(ts, {"context": analysis_json, "image_file": image_key})
+    set_latest_run(store, ts)
 
-    # Image
-    with open(image_path, "rb") as f:
-        cli.put_object(
-            Bucket=S3_BUCKET,
-            Key=folder + img_name,
-            Body=f,
-            ContentType="image/jpeg",
+    if SUMMARY_MODE == "background":
+        post_pool.submit(ensure_summary, ts).add_done_callback(
+            lambda f: log_background_failure(f, f"Background summary for {ts}")
         )
+    # Callers get the context this run stored, as repeats do via the hash index.
+    return {**result, "context": analysis_json}
 
-    # Summary
-    chat_sum = model.start_chat()
-    sum_prompt = (
-        "Summarize this analysis (2–3 sentences):\n"
-        + json.dumps(analysis_json, indent=2)
-    )
-    summary = chat_sum.send_message(sum_prompt).text.strip()
-    cli.put_object(
-        Bucket=S3_BUCKET,
-        Key=folder + sum_name,
-        Body=summary,
-        ContentType="text/plain",
-    )
 
-    return {
-        "message": "Files uploaded successfully",
-        "timestamp": ts,
-        "json_file": folder + json_name,
-        "image_file": folder + img_name,
-        "image_url": f"https://{S3_BUCKET}.s3.amazonaws.com/{folder + img_name}",
-        "summary_file": folder + sum_name,
-    }
+catalog = Catalog(CATALOG_DB)
+
+
+def catalog_run(ts, context, digest, summary, image_key, context_key, prescreen=None):
+    """Index a stored run. The archive is the source of truth, so a catalog
+    error is logged (and fixed by backfill-catalog) rather than failing the run."""
+    try:
+        catalog.add(
+            ts, context,
+            sha256=digest,
+            summary=summary,
+            image_file=image_key,
+            json_file=context_key,
+            prescreen_label=prescreen["label"] if prescreen else None,
+            prescreen_confidence=prescreen["confidence"] if prescreen else None,
+        )
+    except sqlite3.Error as e:
+        print(f"Catalog write failed for {ts}: {e}")
+
+
+# Started lazily so the debug reloader's parent process never runs jobs.
+job_queue = JobQueue(
+    JOB_DIR / "jobs.sqlite3",
+    lambda path: process_mri_scan(path),
+    workers=int(os.environ.get("ANALYSIS_WORKERS", 2)),
+    max_pending=int(os.environ.get("ANALYSIS_MAX_PENDING", 100)),
+)
+
+
+chat_sessions = ChatSessions(
+    model,
+    gateway,
+    max_sessions=int(os.environ.get("CHAT_MAX_SESSIONS", 500)),
+    idle_ttl=float(os.environ.get("CHAT_SESSION_IDLE_TTL", 1800)),
+    token_budget=int(os.environ.get("CHAT_TOKEN_BUDGET", 8000)),
+)
+
+
+viewer_pool = ViewerPool(warm=VIEWER_POOL_WARM, max_open=VIEWER_MAX_OPEN, viewer_args=VIEWER_ARGS)
+atexit.register(viewer_pool.shutdown)
+
+slice_renderer = SliceRenderer(SCANS_DIR, max_volumes=SCAN_CACHE_SIZE, max_tiles=TILE_CACHE_SIZE)
 
 
 # ----------- ROUTES ----------------------------------------------------------
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_timing(response):
+    elapsed = time.perf_counter() - g.pop("request_start", time.perf_counter())
+    registry.observe(
+        "http_request_duration_seconds",
+        elapsed,
+        endpoint=request.endpoint or "unknown",
+        method=request.method,
+        status=response.status_code,
+    )
+    spans = g.pop("server_timing", []) + [("app", elapsed)]
+    response.headers["Server-Timing"] = server_timing_header(spans)
+    return response
+
+
+def model_unavailable(e: ModelUnavailable):
+    """503 with Retry-After, so clients back off instead of re-uploading."""
+    return jsonify({"error": str(e)}), 503, {"Retry-After": str(e.retry_after)}
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/analyze_mri", methods=["POST"])
 def analyze_mri():
     if "file" not in request.files or not request.files["file"].filename:
         return jsonify({"error": "No file provided"}), 400
 
     file = request.files["file"]
-    filename = secure_filename(file.filename)
-    tmp_path = Path(UPLOAD_FOLDER) / filename
-    file.save(tmp_path)
+    # Unique per request: concurrent uploads of one scan share a filename.
+    suffix = Path(secure_filename(file.filename)).suffix or ".jpg"
+    tmp_path = Path(UPLOAD_FOLDER) / f"{uuid.uuid4().hex}{suffix}"
+    with span("save"):
+        file.save(tmp_path)
 
     try:
         result = process_mri_scan(tmp_path)
+    except InvalidImage as e:
+        return jsonify({"error": str(e)}), 400
+    except ModelUnavailable as e:
+        return model_unavailable(e)
     finally:
         try:
             tmp_path.unlink()
@@ -226,121 +805,461 @@ def analyze_mri():
     return jsonify(result), status
 
 
-@app.route("/chat", methods=["POST"])
-def chat():
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """Queue an MRI for background analysis; poll /jobs/<id> for the result."""
+    if "file" not in request.files or not request.files["file"].filename:
+        return jsonify({"error": "No file provided"}), 400
+
+    file = request.files["file"]
+    job_id = uuid.uuid4().hex
+    suffix = Path(secure_filename(file.filename)).suffix or ".jpg"
+    path = JOB_UPLOAD_FOLDER / f"{job_id}{suffix}"
+    file.save(path)
+
+    # Likely tumors run first; the model is re-run on the normalized image later.
+    prescreen = prescreen_file(path)
+    priority = 1 if prescreen and prescreen["label"] == "notumor" else 0
+    try:
+        job = job_queue.submit(path, priority=priority, job_id=job_id)
+    except QueueFull as e:
+        path.unlink(missing_ok=True)
+        return jsonify({"error": f"Analysis queue is full: {e}"}), 503
+
+    job["status_url"] = f"/jobs/{job_id}"
+    return jsonify(job), 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+def chat_request():
+    """Parse a /chat body into ((session, message), None) or (None, error).
+
+    With a ``session_id`` the message is just the question, sent on that
+    session; otherwise ``session`` is None and the message carries the
+    whole context for a one-off chat.
+    """
     data = request.json or {}
     prompt = data.get("prompt", "").strip()
     ts = data.get("timestamp")  # may be None
+    session_id = data.get("session_id")
 
     if not prompt:
-        return jsonify({"error": "No prompt provided"}), 400
+        return None, (jsonify({"error": "No prompt provided"}), 400)
+
+    if session_id:
+        session = chat_sessions.get(session_id, ts)
+        if session is None:
+            return None, (jsonify({"error": "Chat session not found or expired"}), 404)
+        return (session, prompt), None
 
     analysis = get_analysis_by_timestamp(ts) if ts else get_latest_analysis()
     if not analysis:
-        return jsonify({"error": "No analysis context found"}), 404
+        return None, (jsonify({"error": "No analysis context found"}), 404)
 
     context = analysis["context"]
     system_prompt = (
         "You are a medical AI assistant.\n"
-        + json.dumps(context, indent=2)
+        + compact_json(context)
         + f"\nUser Question: {prompt}\n"
         "Answer clearly and concisely, no markdown."
     )
+    return (None, system_prompt), None
+
+
+def sse(data: dict, event: str = None) -> str:
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data)}\n\n"
+
+
+@app.route("/chat/session", methods=["POST"])
+def create_chat_session():
+    """Start a multi-turn session for ``timestamp`` (default: latest run)."""
+    ts = (request.json or {}).get("timestamp")
+    analysis = get_analysis_by_timestamp(ts) if ts else get_latest_analysis()
+    if not analysis:
+        return jsonify({"error": "No analysis context found"}), 404
 
-    resp = model.start_chat().send_message(system_prompt)
-    return jsonify({"response": resp.text})
+    ts = analysis["timestamp"]
+    session_id = chat_sessions.create(ts, analysis["context"])
+    return jsonify({"session_id": session_id, "timestamp": ts}), 201
+
+
+@app.route("/chat", methods=["POST"])
+def chat():
+    parsed, error = chat_request()
+    if error:
+        return error
+
+    session, message = parsed
+    try:
+        with span("chat_model"):
+            if session:
+                text = chat_sessions.send(session, message)
+            else:
+                # Identical one-off questions in flight share one answer.
+                key = ("chat", hashlib.sha256(message.encode()).hexdigest())
+                text = gateway.send(model.start_chat(), message, key=key).text
+    except ModelUnavailable as e:
+        return model_unavailable(e)
+    if session:
+        return jsonify({"response": text, "session_id": session.session_id})
+    return jsonify({"response": text})
+
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """Same payload as /chat, answered as server-sent events.
+
+    Emits ``data: {"text": ...}`` per chunk, then an ``event: done`` with
+    ``ttft_ms`` (time to first token) and ``total_ms``, or ``event: error``.
+    """
+    parsed, error = chat_request()
+    if error:
+        return error
+
+    session, message = parsed
+
+    def events():
+        start = time.perf_counter()
+        ttft_ms = None
+        try:
+            if session:
+                stream = chat_sessions.send_stream(session, message)
+            else:
+                stream = gateway.send_stream(model.start_chat(), message)
+            for chunk in stream:
+                # The closing chunk may carry only a finish reason and no parts.
+                text = chunk.text if chunk.parts else ""
+                if not text:
+                    continue
+                if ttft_ms is None:
+                    ttft_ms = round((time.perf_counter() - start) * 1000, 1)
+                yield sse({"text": text})
+        except Exception as e:
+            print("Chat stream error:", e)
+            yield sse({"error": str(e)}, event="error")
+            return
+
+        total_ms = round((time.perf_counter() - start) * 1000, 1)
+        print(f"/chat/stream ttft={ttft_ms}ms total={total_ms}ms")
+        # Headers are already sent, so these only reach /metrics.
+        if ttft_ms is not None:
+            registry.observe("stage_duration_seconds", ttft_ms / 1000, stage="chat_stream_ttft")
+        registry.observe("stage_duration_seconds", total_ms / 1000, stage="chat_stream_total")
+        yield sse({"ttft_ms": ttft_ms, "total_ms": total_ms}, event="done")
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def not_modified(etag, last_modified) -> bool:
+    """Whether the client's cached copy is current (If-None-Match takes
+    precedence over If-Modified-Since)."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    return bool(since and last_modified.replace(microsecond=0) <= since)
+
+
+def conditional_json(etag, last_modified, build):
+    """JSON response carrying ETag/Last-Modified; ``build()`` returns the
+    body and only runs when the client has no current copy."""
+    if not_modified(etag, last_modified):
+        response = Response(status=304)
+    else:
+        response = Response(build(), mimetype="application/json")
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers["Cache-Control"] = "private, no-cache"  # always revalidate
+    return response
 
 
 @app.route("/history", methods=["GET"])
 def history():
+    """One page of run manifests, newest first.
+
+    Query params: ``limit`` (page size) and ``cursor`` (``next_cursor`` from
+    the previous page). Full contexts are fetched via ``/analysis/<ts>``.
+
+    The page's ETag covers the listed manifests and the signing epoch of the
+    image URLs, so a revalidation costs one listing and no manifest reads;
+    assembled pages are also cached under their ETag.
+    """
+    limit = request.args.get("limit", HISTORY_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    cursor = request.args.get("cursor")
+    if cursor and not cursor.startswith(HISTORY_PREFIX):
+        return jsonify({"error": "Invalid cursor"}), 400
+
     try:
-        cli = s3_client()
-        objs = cli.list_objects_v2(Bucket=S3_BUCKET, Prefix="saved/")
-        if "Contents" not in objs:
-            return jsonify([])
-
-        ctx_files = [o for o in objs["Contents"] if "context_" in o["Key"]]
-        all_files = objs["Contents"]
-
-        history = []
-        for ctx in ctx_files:
-            ts = ctx["Key"].split("context_")[1].split(".json")[0]
-            img = next(
-                (f for f in all_files if f"saved/{ts}/mri_{ts}" in f["Key"]), None
-            )
-            summ = next(
-                (f for f in all_files if f"saved/{ts}/summary_{ts}" in f["Key"]), None
+        store = get_storage()
+        with span("storage_list"):
+            objs, truncated = store.list(
+                HISTORY_PREFIX, start_after=cursor, max_keys=limit
             )
-            if not (img and summ):
-                continue
-
-            img_url = f"https://{S3_BUCKET}.s3.amazonaws.com/{img['Key']}"
-            ctx_obj = cli.get_object(Bucket=S3_BUCKET, Key=ctx["Key"])
-            ctx_json = json.loads(ctx_obj["Body"].read())
-
-            summ_obj = cli.get_object(Bucket=S3_BUCKET, Key=summ["Key"])
-            summ_txt = summ_obj["Body"].read().decode()
-
-            history.append(
-                {
-                    "timestamp": ts,
-                    "mri_url": img_url,
-                    "context": ctx_json,
-                    "summary": summ_txt,
-                }
-            )
-
-        history.sort(key=lambda x: x["timestamp"], reverse=True)
-        return jsonify(history)
+        keys = [o["Key"] for o in objs]
+        next_cursor = keys[-1] if keys and truncated else None
+        etag = hashlib.sha1(json.dumps([
+            limit, cursor, signing_epoch(), next_cursor,
+            [(o["Key"], o["LastModified"].isoformat(), o.get("ETag")) for o in objs],
+        ]).encode()).hexdigest()
+        last_modified = max([signing_epoch_start(), *(o["LastModified"] for o in objs)])
+
+        def load(key):
+            with span("storage_get_manifest"):
+                manifest = json.loads(store.get(key))
+            if manifest.get("summary") is None:
+                with span("lazy_summary"):
+                    manifest = ensure_summary(manifest["timestamp"])
+            return manifest
+
+        def build():
+            page = history_page_cache.get(etag)
+            if page is None:
+                with ThreadPoolExecutor(max_workers=8) as pool:
+                    futures = [
+                        pool.submit(contextvars.copy_context().run, load, k) for k in keys
+                    ]
+                    items = [history_item(f.result()) for f in futures]
+                page = json.dumps({"items": items, "next_cursor": next_cursor})
+                history_page_cache.set(etag, page)
+            return page
+
+        return conditional_json(etag, last_modified, build)
     except Exception as e:
         print("History error:", e)
         return jsonify({"error": str(e)}), 500
 
+
+@app.route("/search", methods=["GET"])
+def search():
+    """Filter runs by date and findings from the local catalog.
+
+    Query params: ``from``/``to`` (YYYY-MM-DD or run timestamp), ``present``
+    (true/false), ``type`` (comma-separated tumor types), ``near=x,y,z`` with
+    ``radius`` (default 20), ``prescreen``, ``sha256``, ``limit`` and
+    ``cursor`` (``next_cursor`` from the previous page).
+    """
+    args = request.args
+    try:
+        start = search_bound(args["from"]) if args.get("from") else None
+        end = search_bound(args["to"], end=True) if args.get("to") else None
+        present = args.get("present")
+        if present is not None:
+            present = {"true": True, "1": True, "false": False, "0": False}[present.lower()]
+        near = tuple(float(v) for v in args["near"].split(",")) if args.get("near") else None
+        if near is not None and len(near) != 3:
+            raise ValueError("near must be x,y,z")
+        radius = args.get("radius", 20.0, type=float)
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": f"Invalid search parameters: {e}"}), 400
+    cursor = args.get("cursor")
+    if cursor and not TIMESTAMP_RE.match(cursor):
+        return jsonify({"error": "Invalid cursor"}), 400
+    limit = max(1, min(args.get("limit", HISTORY_PAGE_SIZE, type=int), SEARCH_MAX_LIMIT))
+    tumor_types = [t.strip().lower() for t in args.get("type", "").split(",") if t.strip()]
+
+    with span("catalog_search"):
+        items = catalog.search(
+            start=start, end=end, present=present, tumor_types=tumor_types,
+            near=near, radius=radius, sha256=args.get("sha256"),
+            prescreen_label=args.get("prescreen"), limit=limit + 1, before=cursor,
+        )
+    for item in items:
+        item["mri_url"] = signed_url(item["image_file"]) if item["image_file"] else None
+    next_cursor = items[limit - 1]["timestamp"] if len(items) > limit else None
+    return jsonify({"items": items[:limit], "next_cursor": next_cursor})
+
+
+@app.route("/analysis/<ts>", methods=["GET"])
+def analysis(ts):
+    """Full context for one run, fetched on demand. Contexts never change,
+    so only the signing epoch of ``mri_url`` moves the ETag."""
+    if not TIMESTAMP_RE.match(ts):
+        return jsonify({"error": "Invalid timestamp"}), 400
+    created = run_time(ts).astimezone(timezone.utc)
+    try:
+        return conditional_json(
+            f"{ts}-{signing_epoch()}", max(created, signing_epoch_start()),
+            lambda: json.dumps(get_analysis_by_timestamp(ts)),
+        )
+    except Exception as e:
+        print("Analysis lookup error:", e)
+        return jsonify({"error": f"No analysis found for {ts}"}), 404
+
+
+@app.route("/files/<path:key>", methods=["GET"])
+def files(key):
+    """Serve archived objects when running on the local storage backend."""
+    store = get_storage()
+    if not isinstance(store, LocalStorage):
+        abort(404)
+    return send_from_directory(store.root, key)
+
+
+def scan_marker():
+    """Tumor marker for the run named by ``?timestamp=``, if any. Returns
+    (marker, error response)."""
+    ts = request.args.get("timestamp")
+    if not ts:
+        return None, None
+    if not TIMESTAMP_RE.match(ts):
+        return None, (jsonify({"error": "Invalid timestamp"}), 400)
+    try:
+        return tumor_marker(get_analysis_by_timestamp(ts)["context"]), None
+    except FileNotFoundError:
+        return None, (jsonify({"error": f"No analysis found for {ts}"}), 404)
+
+
+def png_response(render):
+    try:
+        with span("render_tile"):
+            png = render()
+    except FileNotFoundError:
+        return jsonify({"error": "Scan not found"}), 404
+    except (IndexError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    return Response(png, mimetype="image/png", headers={"Cache-Control": "private, max-age=300"})
+
+
+@app.route("/scans/<scan>", methods=["GET"])
+def scan_info(scan):
+    """Shape and contrast limits of a scan, loading it into the volume cache."""
+    try:
+        with span("scan_load"):
+            return jsonify(slice_renderer.info(scan))
+    except FileNotFoundError:
+        return jsonify({"error": "Scan not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route("/scans/<scan>/slice/<axis>/<int:index>.png", methods=["GET"])
+def scan_slice(scan, axis, index):
+    """One axial/coronal/sagittal slice; ``?timestamp=`` draws that run's tumor marker."""
+    marker, error = scan_marker()
+    if error:
+        return error
+    return png_response(lambda: slice_renderer.slice_png(scan, axis, index, marker))
+
+
+@app.route("/scans/<scan>/mip/<axis>.png", methods=["GET"])
+def scan_mip(scan, axis):
+    """Maximum-intensity projection along ``axis``."""
+    marker, error = scan_marker()
+    if error:
+        return error
+    return png_response(lambda: slice_renderer.mip_png(scan, axis, marker))
+
+
+@app.cli.command("backfill-history")
+def backfill_history():
+    """Write history manifests for runs archived before the index existed."""
+    store = get_storage()
+    runs = {}
+    for key in store.iter_keys("saved/"):
+        parts = key.split("/")
+        if len(parts) == 3 and TIMESTAMP_RE.match(parts[1]):
+            runs.setdefault(parts[1], []).append(parts[2])
+
+    written = 0
+    for ts, names in sorted(runs.items()):
+        img = next((n for n in names if n.startswith(f"mri_{ts}")), None)
+        if not img or f"summary_{ts}.txt" not in names:
+            continue
+        summary_key = f"saved/{ts}/summary_{ts}.txt"
+        summary = store.get(summary_key).decode()
+        write_history_manifest(
+            store, ts, f"saved/{ts}/{img}", summary, summary_file=summary_key
+        )
+        written += 1
+    print(f"Backfilled {written} history manifests")
+
+
+@app.cli.command("backfill-catalog")
+def backfill_catalog():
+    """Index every archived run in the local catalog (safe to re-run)."""
+    store = get_storage()
+    digests = {}
+    for key in store.iter_keys(HASH_INDEX_PREFIX):
+        record = json.loads(store.get(key))
+        digests[record["timestamp"]] = record.get("sha256") or key.removeprefix(HASH_INDEX_PREFIX).removesuffix(".json")
+    runs = {}
+    for key in store.iter_keys("saved/"):
+        parts = key.split("/")
+        if len(parts) == 3 and TIMESTAMP_RE.match(parts[1]):
+            runs.setdefault(parts[1], []).append(parts[2])
+
+    def index(ts, names):
+        context_key = f"saved/{ts}/context_{ts}.json"
+        if f"context_{ts}.json" not in names:
+            return False
+        try:
+            manifest = json.loads(store.get(history_key(ts)))
+        except FileNotFoundError:
+            manifest = {}
+        img = next((n for n in names if n.startswith(f"mri_{ts}")), None)
+        prescreen = None
+        if f"prescreen_{ts}.json" in names:
+            prescreen = json.loads(store.get(f"saved/{ts}/prescreen_{ts}.json"))
+        summary = manifest.get("summary")
+        if summary is None and f"summary_{ts}.txt" in names:
+            summary = store.get(f"saved/{ts}/summary_{ts}.txt").decode()
+        catalog_run(
+            ts, json.loads(store.get(context_key)), digests.get(ts), summary,
+            f"saved/{ts}/{img}" if img else None, context_key, prescreen,
+        )
+        return True
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        written = sum(pool.map(lambda run: index(*run), sorted(runs.items())))
+    print(f"Indexed {written} runs; catalog holds {catalog.count()}")
+
 @app.route('/run-viewer', methods=['POST'])
 def run_viewer():
-    print("hello")
-    data = request.json
+    """Show ``scanDir`` in a pooled napari window, marked at the tumor of
+    run ``timestamp`` (default: latest run)."""
+    data = request.json or {}
     scan_dir = data.get('scanDir', 'scan')  # Default to 'scan' if not provided
-    
-    # Get the latest analysis to get tumor coordinates
-    analysis = get_latest_analysis()
+    ts = data.get('timestamp')
+    if ts and not TIMESTAMP_RE.match(ts):
+        return jsonify({"success": False, "error": "Invalid timestamp"}), 400
+
+    # Cached lookups: the named run, or the latest-run pointer
+    analysis = get_analysis_by_timestamp(ts) if ts else get_latest_analysis()
     if not analysis:
         return jsonify({"success": False, "error": "No analysis context found"}), 404
-    
-    context = analysis['context']
-    tumor_coords = None
-    if context.get('tumor_detection', {}).get('present', False):
-        tumor_coords = context['tumor_detection']['coordinates']
-    
+    tumor_coords = tumor_marker(analysis['context'])
+
     # Convert to absolute path if it's a relative path
     if not os.path.isabs(scan_dir):
         # Define your scans directory relative to your Flask app
-        scan_dir = os.path.join(os.path.dirname(__file__), 'scans', scan_dir)
-    
-    def run_script_async():
-        try:
-            # Make sure the script path is correct
-            script_path = os.path.join(os.path.dirname(__file__), 'viewer.py')
-            # Pass tumor coordinates as additional arguments if they exist
-            cmd = [sys.executable, script_path, scan_dir]
-            if tumor_coords:
-                cmd.extend(['--tumor-coords', str(tumor_coords['x']), str(tumor_coords['y']), str(tumor_coords['z'])])
-            print(f"Executing command: {' '.join(cmd)}")
-            process = subprocess.Popen(cmd)
-            # Not waiting for the process to complete
-        except Exception as e:
-            print(f"Error running viewer: {str(e)}")
+        scan_dir = os.path.join(SCANS_DIR, scan_dir)
     
     # Check if directory exists
     if not os.path.isdir(scan_dir):
         return jsonify({"success": False, "error": f"Scan directory not found: {scan_dir}"}), 404
-    
-    # Run in a separate thread
-    thread = Thread(target=run_script_async)
-    thread.daemon = True  # This ensures the thread will die when the main process exits
-    thread.start()
-    
-    return jsonify({"success": True, "message": f"Viewer launched for scan directory: {scan_dir}"})
+
+    try:
+        opened = viewer_pool.open(os.path.realpath(scan_dir), tumor_coords)
+    except ViewerLimit as e:
+        return jsonify({"success": False, "error": str(e)}), 429
+    except (TimeoutError, OSError) as e:
+        print(f"Error running viewer: {str(e)}")
+        return jsonify({"success": False, "error": f"Viewer unavailable: {e}"}), 503
+
+    action = "Reused viewer" if opened["reused"] else "Viewer launched"
+    return jsonify({"success": True, "reused": opened["reused"], "message": f"{action} for scan directory: {scan_dir}"})
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,188 @@
+"""Run the /analyze_mri pipeline over the bundled dataset.
+
+Walks data/<split>/<label>/ (glioma, meningioma, notumor, pituitary), runs
+``process_mri_scan`` on each image with bounded concurrency and a
+client-side request rate, and appends one JSON line per image to a
+checkpoint file. Re-running with the same checkpoint skips images that are
+already recorded. Finishes with throughput and per-class accuracy of the
+model's tumor type against the folder label.
+
+    python batch_analyze.py --splits Testing --concurrency 4 --rpm 60
+"""
+
+import argparse
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from analysis import AnalysisError, analysis_from_dict
+from dataset import DATA_DIR, LABELS, label_images
+
+
+class RateLimiter:
+    """Space calls at least ``60 / rpm`` seconds apart across threads."""
+
+    def __init__(self, rpm):
+        self.interval = 60.0 / rpm if rpm else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def predicted_label(context) -> str:
+    """Map an analysis context onto one of LABELS (or 'unknown'). Schema
+    records are read directly; older free-form contexts are keyword-matched."""
+    try:
+        record = analysis_from_dict(context)
+    except AnalysisError:
+        record = None
+    if record is not None:
+        detection = record.tumor_detection
+        if not detection.present:
+            return "notumor"
+        return detection.type if detection.type in LABELS else "unknown"
+    detection = context.get("tumor_detection", context) if isinstance(context, dict) else context
+    if isinstance(detection, dict) and detection.get("present") is False:
+        return "notumor"
+    text = json.dumps(detection).lower()
+    hits = {label: text.find(label) for label in LABELS if label != "notumor"}
+    hits = {label: pos for label, pos in hits.items() if pos >= 0}
+    if hits:
+        return min(hits, key=hits.get)  # the type named first
+    if isinstance(detection, dict) and detection.get("present"):
+        return "unknown"
+    return "notumor"
+
+
+def collect_images(splits, limit=None):
+    images = []
+    for split in splits:
+        for label in LABELS:
+            images.extend((split, label, p) for p in label_images(split, label, limit))
+    return images
+
+
+def load_checkpoint(path: Path):
+    records = []
+    if path.exists():
+        for line in path.read_text().splitlines():
+            if line.strip():
+                records.append(json.loads(line))
+    return records
+
+
+def analyze_one(app, split, label, path: Path):
+    start = time.perf_counter()
+    record = {"split": split, "label": label, "path": str(path.relative_to(DATA_DIR))}
+    try:
+        result = app.process_mri_scan(path)
+        if "error" in result:
+            record["error"] = result["error"]
+        else:
+            ts = result["timestamp"]
+            context = result["context"]  # the analysis this image produced
+            record.update(
+                timestamp=ts,
+                cached=bool(result.get("cached")),
+                predicted=predicted_label(context),
+            )
+    except Exception as e:
+        record["error"] = str(e)
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def report(records, elapsed, processed):
+    print("\n===== Batch report =====")
+    if processed:
+        print(
+            f"This run: {processed} images in {elapsed:.1f}s "
+            f"({processed / elapsed * 60:.1f} images/min)"
+        )
+    scored = [r for r in records if "predicted" in r]
+    errors = sum(1 for r in records if "error" in r)
+    if scored:
+        mean = sum(r["seconds"] for r in scored) / len(scored)
+        print(f"Mean latency per image: {mean:.2f}s  (errors: {errors})")
+
+    per_class = defaultdict(Counter)
+    for r in scored:
+        per_class[r["label"]][r["predicted"]] += 1
+
+    correct = sum(c[label] for label, c in per_class.items())
+    print(f"\n{'label':<12}{'n':>6}{'accuracy':>10}   predicted as")
+    for label in LABELS:
+        counts = per_class.get(label)
+        if not counts:
+            continue
+        n = sum(counts.values())
+        spread = ", ".join(f"{k}={v}" for k, v in counts.most_common())
+        print(f"{label:<12}{n:>6}{counts[label] / n:>10.1%}   {spread}")
+    if scored:
+        print(f"{'overall':<12}{len(scored):>6}{correct / len(scored):>10.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--splits", nargs="+", default=["Training", "Testing"])
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rpm", type=float, default=60, help="Max scans started per minute (0 = no limit).")
+    parser.add_argument("--limit", type=int, help="Max images per class and split.")
+    parser.add_argument("--checkpoint", type=Path, default=Path("batch_results.jsonl"))
+    parser.add_argument("--retry-errors", action="store_true", help="Re-run images whose recorded result was an error.")
+    args = parser.parse_args()
+
+    records = load_checkpoint(args.checkpoint)
+    if args.retry_errors:
+        records = [r for r in records if "error" not in r]
+    done = {r["path"] for r in records}
+    todo = [
+        item for item in collect_images(args.splits, args.limit)
+        if str(item[2].relative_to(DATA_DIR)) not in done
+    ]
+    print(f"{len(done)} images already in {args.checkpoint}, {len(todo)} to go")
+
+    import app  # deferred: loads .env.local and configures Gemini
+
+    limiter = RateLimiter(args.rpm)
+    start = time.perf_counter()
+
+    def run(item):
+        limiter.wait()
+        return analyze_one(app, *item)
+
+    # Rewrite the checkpoint when dropping errored records, then append.
+    mode = "w" if args.retry_errors else "a"
+    with open(args.checkpoint, mode) as out:
+        if mode == "w":
+            out.writelines(json.dumps(r) + "\n" for r in records)
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            futures = [pool.submit(run, item) for item in todo]
+            try:
+                for i, future in enumerate(as_completed(futures), 1):
+                    record = future.result()
+                    out.write(json.dumps(record) + "\n")
+                    out.flush()
+                    records.append(record)
+                    status = record.get("predicted", "error")
+                    print(f"[{i}/{len(todo)}] {record['path']} -> {status} ({record['seconds']}s)")
+            except KeyboardInterrupt:
+                print("\nInterrupted; progress is saved, re-run to resume.")
+                for f in futures:
+                    f.cancel()
+
+    report(records, time.perf_counter() - start, len(records) - len(done))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""Offline load test for the Flask API.
+
+Swaps Gemini (``model``, ``genai.upload_file``/``genai.get_file``) for a fake
+with configurable latency and the storage backend for an in-memory object
+store that behaves like S3 (sorted keys, prefix listing, per-call latency).
+It seeds a large synthetic history, drives the endpoints from concurrent
+clients through Flask's test client, and reports p50/p95/p99 latency and
+requests/sec per endpoint. No network access or credentials are needed.
+
+    python bench.py --history-size 20000 --concurrency 16 --requests 400
+"""
+
+import argparse
+import bisect
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+
+FAKE_ANALYSIS = {
+    "tumor_detection": {
+        "present": True,
+        "type": "glioma",
+        "location": "left temporal lobe",
+        "size": "2.1 cm",
+        "characteristics": "heterogeneous enhancement",
+        "coordinates": {"x": 180, "y": 95, "z": 140},
+    },
+    "gray_matter_assessment": {"loss_detected": False, "regions_affected": [], "severity": "none"},
+    "other_abnormalities": [],
+    "recommended_follow_up": ["Contrast-enhanced MRI", "Neurosurgical consult"],
+}
+
+
+# ----------- FAKES -----------------------------------------------------------
+
+def sleep_ms(ms, jitter=0.2):
+    if ms > 0:
+        time.sleep(ms / 1000 * random.uniform(1 - jitter, 1 + jitter))
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.parts = [text]
+
+
+class FakeContent:
+    def __init__(self, role, texts):
+        self.role = role
+        self.parts = [type("Part", (), {"text": t})() for t in texts]
+
+
+class FakeChat:
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = [FakeContent(h["role"], h["parts"]) for h in history or []]
+
+    def send_message(self, content, stream=False):
+        # A list means image + prompt (the analysis call); a string is text-only.
+        is_analysis = not isinstance(content, str)
+        text = json.dumps(FAKE_ANALYSIS) if is_analysis else "The scan shows a small glioma. Follow-up is advised."
+        latency = self.model.analysis_ms if is_analysis else self.model.text_ms
+        if not is_analysis:
+            self.history += [FakeContent("user", [content]), FakeContent("model", [text])]
+        if not stream:
+            sleep_ms(latency)
+            return FakeResponse(text)
+        return self._stream(text, latency)
+
+    def _stream(self, text, latency):
+        words = text.split(" ")
+        sleep_ms(latency * 0.3)  # time to first token
+        for i, word in enumerate(words):
+            sleep_ms(latency * 0.7 / len(words))
+            yield FakeResponse(word + (" " if i < len(words) - 1 else ""))
+
+
+class FakeModel:
+    def __init__(self, analysis_ms, text_ms):
+        self.analysis_ms = analysis_ms
+        self.text_ms = text_ms
+
+    def start_chat(self, history=None):
+        return FakeChat(self, history)
+
+
+class FakeFile:
+    def __init__(self, name):
+        self.name = name
+        self.state = type("State", (), {"name": "ACTIVE"})()
+
+
+class MemoryStorage:
+    """In-memory object store with S3 listing semantics."""
+
+    def __init__(self, latency_ms=0.0):
+        self.latency_ms = latency_ms
+        self._objects = {}
+        self._keys = []  # kept sorted for prefix/StartAfter listing
+        self._lock = threading.Lock()
+
+    def put(self, key, body, content_type):
+        sleep_ms(self.latency_ms)
+        if hasattr(body, "read"):
+            body = body.read()
+        if isinstance(body, str):
+            body = body.encode()
+        self._put(key, body)
+
+    def _put(self, key, body):
+        with self._lock:
+            if key not in self._objects:
+                bisect.insort(self._keys, key)
+            self._objects[key] = (body, datetime.now(timezone.utc))
+
+    def get(self, key):
+        sleep_ms(self.latency_ms)
+        try:
+            return self._objects[key][0]
+        except KeyError:
+            raise FileNotFoundError(key)
+
+    def list(self, prefix, start_after=None, max_keys=1000):
+        sleep_ms(self.latency_ms)
+        with self._lock:
+            if start_after and start_after >= prefix:
+                i = bisect.bisect_right(self._keys, start_after)
+            else:
+                i = bisect.bisect_left(self._keys, prefix)
+            keys = []
+            while i < len(self._keys) and self._keys[i].startswith(prefix) and len(keys) <= max_keys:
+                keys.append(self._keys[i])
+                i += 1
+        objs = [{"Key": k, "LastModified": self._objects[k][1]} for k in keys[:max_keys]]
+        return objs, len(keys) > max_keys
+
+    def iter_keys(self, prefix):
+        with self._lock:
+            keys = [k for k in self._keys if k.startswith(prefix)]
+        return iter(keys)
+
+    def url(self, key):
+        return f"http://bench.local/files/{key}"
+
+    def signed_url(self, key, expires):
+        return self.url(key)
+
+
+def install_fakes(app_module, store, args):
+    import storage
+
+    fake = FakeModel(args.model_ms, args.text_ms)
+    app_module.model = fake
+    app_module.analysis_model = fake
+    app_module.chat_sessions.model = fake
+    app_module.genai.upload_file = lambda path, mime_type=None: (
+        sleep_ms(args.upload_ms), FakeFile(f"files/{random.getrandbits(32):x}")
+    )[1]
+    app_module.genai.get_file = lambda name: FakeFile(name)
+    storage._storage = store
+
+
+def seed_history(app_module, store, n):
+    """Write ``n`` archived runs directly into the store (no latency)."""
+    base = datetime(2024, 1, 1)
+    context = json.dumps(FAKE_ANALYSIS, indent=4).encode()
+    for i in range(n):
+        ts = (base + timedelta(seconds=i)).strftime("%Y%m%d_%H%M%S")
+        folder = f"saved/{ts}/"
+        store._put(f"{folder}context_{ts}.json", context)
+        store._put(f"{folder}mri_{ts}.jpg", b"\xff\xd8synthetic\xff\xd9")
+        store._put(f"{folder}summary_{ts}.txt", b"Synthetic summary.")
+        manifest = {
+            "timestamp": ts,
+            "summary": "Synthetic summary.",
+            "image_file": f"{folder}mri_{ts}.jpg",
+            "json_file": f"{folder}context_{ts}.json",
+            "summary_file": f"{folder}summary_{ts}.txt",
+        }
+        store._put(app_module.history_key(ts), json.dumps(manifest).encode())
+
+
+# ----------- LOAD DRIVER -----------------------------------------------------
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def run_endpoint(name, flask_app, make_request, n, concurrency):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    local = threading.local()
+
+    def one(i):
+        nonlocal errors
+        if not hasattr(local, "client"):
+            local.client = flask_app.test_client()
+        start = time.perf_counter()
+        resp = make_request(local.client, i)
+        resp.get_data()  # drain streamed bodies
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed)
+            if resp.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(n)))
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "endpoint": name,
+        "requests": n,
+        "errors": errors,
+        "rps": n / wall,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--history-size", type=int, default=10_000)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--model-ms", type=float, default=1500, help="Fake analysis call latency.")
+    parser.add_argument("--text-ms", type=float, default=600, help="Fake summary/chat call latency.")
+    parser.add_argument("--upload-ms", type=float, default=300, help="Fake Files API upload latency.")
+    parser.add_argument("--storage-ms", type=float, default=20, help="Fake object store latency per call.")
+    parser.add_argument("--endpoints", nargs="+", default=["analyze_mri", "chat", "chat_stream", "history", "history_deep"])
+    args = parser.parse_args()
+
+    os.environ.setdefault("GOOGLE_API_KEY", "bench")
+    os.environ.setdefault("GEMINI_RPM", "0")  # measure the app, not the client-side rate limit
+    os.environ.setdefault("GEMINI_TPM", "0")
+    # Fake runs must not reach the real catalog or job queue.
+    scratch = Path(tempfile.mkdtemp(prefix="bench_"))
+    os.environ["CATALOG_DB"] = str(scratch / "catalog.sqlite3")
+    os.environ["JOB_DIR"] = str(scratch / "jobs")
+    import app as app_module
+
+    store = MemoryStorage(args.storage_ms)
+    install_fakes(app_module, store, args)
+    t0 = time.perf_counter()
+    seed_history(app_module, store, args.history_size)
+    print(f"Seeded {args.history_size} runs in {time.perf_counter() - t0:.1f}s")
+
+    images = sorted((DATA_DIR / "Testing").glob("*/*.jpg"))[:50]
+    image_bytes = [p.read_bytes() for p in images]
+    latest_ts = app_module.get_latest_timestamp()
+
+    # Deep pages: walk the index once to collect cursors spread across it.
+    cursors = [None]
+    objs, _ = store.list(app_module.HISTORY_PREFIX, max_keys=args.history_size)
+    cursors += [o["Key"] for o in objs[99::100]]
+
+    def analyze(client, i):
+        # Trailing bytes keep each upload unique (JPEG decoders ignore them),
+        # so the dedup cache does not short-circuit the pipeline.
+        body = image_bytes[i % len(image_bytes)] + os.urandom(16)
+        return client.post(
+            "/analyze_mri",
+            data={"file": (io.BytesIO(body), f"bench_{i}.jpg")},
+            content_type="multipart/form-data",
+        )
+
+    requests = {
+        "analyze_mri": analyze,
+        "chat": lambda c, i: c.post("/chat", json={"prompt": "Is there a tumor?", "timestamp": latest_ts}),
+        "chat_stream": lambda c, i: c.post("/chat/stream", json={"prompt": "Is there a tumor?", "timestamp": latest_ts}),
+        "history": lambda c, i: c.get("/history?limit=20"),
+        "history_deep": lambda c, i: c.get(
+            "/history?limit=20" + (f"&cursor={cursors[i % len(cursors)]}" if cursors[i % len(cursors)] else "")
+        ),
+    }
+
+    results = [
+        run_endpoint(name, app_module.app, requests[name], args.requests, args.concurrency)
+        for name in args.endpoints
+    ]
+
+    print(
+        f"\nhistory={args.history_size} concurrency={args.concurrency} "
+        f"model={args.model_ms}ms text={args.text_ms}ms storage={args.storage_ms}ms"
+    )
+    print(f"{'endpoint':<14}{'req':>6}{'err':>5}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for r in results:
+        print(
+            f"{r['endpoint']:<14}{r['requests']:>6}{r['errors']:>5}{r['rps']:>9.1f}"
+            f"{r['p50']:>10.1f}{r['p95']:>10.1f}{r['p99']:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
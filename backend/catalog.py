@@ -0,0 +1,150 @@
+"""Local SQLite catalog of analyzed runs.
+
+One row per run with the findings people search by (tumor presence and
+type, coordinates, gray matter loss, pre-screen label) and the content
+hash, written when a run is stored and rebuilt from the ``saved/`` archive
+with ``flask backfill-catalog``. ``/search`` answers from here without
+touching object storage.
+"""
+
+from pathlib import Path
+
+from analysis import TUMOR_TYPES, AnalysisError, analysis_from_dict, tumor_marker
+from sqlitedb import connect
+
+COLUMNS = (
+    "timestamp", "sha256", "tumor_present", "tumor_type", "x", "y", "z",
+    "gray_matter_loss", "prescreen_label", "prescreen_confidence", "source",
+    "summary", "image_file", "json_file",
+)
+
+
+def findings(context) -> dict:
+    """Searchable fields of an analysis context; older free-form contexts
+    are read as far as they go."""
+    try:
+        record = analysis_from_dict(context)
+        detection = record.tumor_detection
+        present, tumor_type = detection.present, detection.type
+        loss = record.gray_matter_assessment.loss_detected
+    except AnalysisError:
+        detection = context.get("tumor_detection") if isinstance(context, dict) else None
+        if not isinstance(detection, dict):  # e.g. a prose description
+            detection = {"type": detection}
+        text = str(detection.get("type") or "").lower()
+        present = detection.get("present") if isinstance(detection.get("present"), bool) else None
+        tumor_type = next((t for t in TUMOR_TYPES if t in text), None)
+        loss = None
+    marker = tumor_marker(context) or (None, None, None)
+    return {
+        "tumor_present": present,
+        "tumor_type": tumor_type.lower() if tumor_type else None,
+        "x": marker[0], "y": marker[1], "z": marker[2],
+        "gray_matter_loss": loss,
+        "source": context.get("source", "gemini") if isinstance(context, dict) else None,
+    }
+
+
+class Catalog:
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")  # searches don't wait on ingest writes
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS runs (
+                       timestamp TEXT PRIMARY KEY,
+                       sha256 TEXT,
+                       tumor_present INTEGER,
+                       tumor_type TEXT,
+                       x REAL,
+                       y REAL,
+                       z REAL,
+                       gray_matter_loss INTEGER,
+                       prescreen_label TEXT,
+                       prescreen_confidence REAL,
+                       source TEXT,
+                       summary TEXT,
+                       image_file TEXT,
+                       json_file TEXT
+                   )"""
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS runs_sha256 ON runs(sha256)")
+            db.execute("CREATE INDEX IF NOT EXISTS runs_findings ON runs(tumor_present, tumor_type, timestamp)")
+            db.execute("CREATE INDEX IF NOT EXISTS runs_coordinates ON runs(x, y, z)")
+
+    def _db(self):
+        return connect(self.db_path)
+
+    def add(self, ts, context, **fields):
+        """Insert or replace the row for run ``ts``. ``fields`` fills the
+        columns that don't come from the context (sha256, summary, ...)."""
+        row = {"timestamp": ts, **findings(context), **fields}
+        values = [row.get(c) for c in COLUMNS]
+        with self._db() as db:
+            db.execute(
+                f"INSERT OR REPLACE INTO runs ({', '.join(COLUMNS)})"
+                f" VALUES ({', '.join('?' * len(COLUMNS))})",
+                values,
+            )
+
+    def set_summary(self, ts, summary):
+        with self._db() as db:
+            db.execute("UPDATE runs SET summary = ? WHERE timestamp = ?", (summary, ts))
+
+    def search(self, start=None, end=None, present=None, tumor_types=None, near=None,
+               radius=None, sha256=None, prescreen_label=None, limit=50, before=None):
+        """Runs matching every given filter, newest first. ``start``/``end``
+        and ``before`` are run timestamps; ``near`` is an (x, y, z) point
+        matched within ``radius``."""
+        where, params = [], []
+        if start:
+            where.append("timestamp >= ?")
+            params.append(start)
+        if end:
+            where.append("timestamp <= ?")
+            params.append(end)
+        if before:
+            where.append("timestamp < ?")
+            params.append(before)
+        if present is not None:
+            where.append("tumor_present = ?")
+            params.append(int(present))
+        if tumor_types:
+            where.append(f"tumor_type IN ({', '.join('?' * len(tumor_types))})")
+            params += list(tumor_types)
+        if sha256:
+            where.append("sha256 = ?")
+            params.append(sha256)
+        if prescreen_label:
+            where.append("prescreen_label = ?")
+            params.append(prescreen_label)
+        if near is not None:
+            # The box lets SQLite use the coordinate index; the sphere is exact.
+            for col, v in zip("xyz", near):
+                where.append(f"{col} BETWEEN ? AND ?")
+                params += [v - radius, v + radius]
+            where.append("(x - ?) * (x - ?) + (y - ?) * (y - ?) + (z - ?) * (z - ?) <= ?")
+            params += [near[0], near[0], near[1], near[1], near[2], near[2], radius * radius]
+
+        sql = f"SELECT {', '.join(COLUMNS)} FROM runs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY timestamp DESC LIMIT ?"
+        with self._db() as db:
+            rows = db.execute(sql, (*params, limit)).fetchall()
+        return [self._item(row) for row in rows]
+
+    @staticmethod
+    def _item(row):
+        item = dict(zip(COLUMNS, row))
+        for col in ("tumor_present", "gray_matter_loss"):
+            if item[col] is not None:
+                item[col] = bool(item[col])
+        x, y, z = item.pop("x"), item.pop("y"), item.pop("z")
+        item["coordinates"] = None if x is None else {"x": x, "y": y, "z": z}
+        return item
+
+    def count(self):
+        with self._db() as db:
+            return db.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
@@ -0,0 +1,17 @@
+"""Layout of the bundled MRI dataset: data/<split>/<label>/<image>.
+
+Shared by the pre-screen classifier and the batch accuracy report so both
+read the same labels and file types.
+"""
+
+from pathlib import Path
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+LABELS = ("glioma", "meningioma", "notumor", "pituitary")
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+
+
+def label_images(split, label, limit=None):
+    """Sorted image paths in data/<split>/<label>/, at most ``limit``."""
+    folder = DATA_DIR / split / label
+    return sorted(p for p in folder.glob("*") if p.suffix.lower() in IMAGE_SUFFIXES)[:limit]
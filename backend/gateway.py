@@ -0,0 +1,196 @@
+"""Shared gateway for Gemini calls.
+
+Every model call goes through one ``ModelGateway``, which
+
+* admits calls through token buckets on requests and (estimated) tokens
+  per minute, and caps how many are in flight at once;
+* retries transient errors (quota, overload, timeouts) up to
+  ``max_retries`` times with full-jitter exponential backoff, charging
+  every attempt to the rate limits;
+* coalesces identical in-flight calls when given a ``key``, so concurrent
+  requests for the same summary or one-off chat answer share one call.
+
+A call that cannot be admitted within ``max_wait`` seconds, or that still
+fails after ``max_retries`` retries of transient errors, raises
+``ModelUnavailable`` so the API can answer 503 instead of a generic 500.
+Queue depth, in-flight calls, admission wait and retries are exported via
+``metrics.registry``.
+"""
+
+import random
+import threading
+import time
+
+from google.api_core import exceptions as api_exceptions
+
+from cache import Coalescer
+from metrics import registry
+from sessions import estimate_tokens
+
+TRANSIENT_ERRORS = (
+    api_exceptions.ResourceExhausted,
+    api_exceptions.TooManyRequests,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.InternalServerError,
+    api_exceptions.DeadlineExceeded,
+    ConnectionError,
+    TimeoutError,
+)
+IMAGE_TOKENS = 258  # Gemini's per-image input cost
+OUTPUT_TOKENS = 512  # allowance for the reply, which is not known up front
+
+registry.describe("model_gateway_queue_depth", "Model calls waiting for admission.")
+registry.describe("model_gateway_in_flight", "Model calls currently running.")
+registry.describe("model_gateway_wait_seconds", "Time a model call waited for rate limit and concurrency slots.")
+registry.describe("model_gateway_calls_total", "Model calls by kind and outcome.")
+registry.describe("model_gateway_retries_total", "Retries of transient model errors.")
+registry.describe("model_gateway_coalesced_total", "Calls answered by an identical in-flight call.")
+
+
+class ModelUnavailable(RuntimeError):
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """``rate`` units per second with bursts up to ``capacity``. ``reserve``
+    books the units immediately and returns how long to wait for them, so
+    callers queue in arrival order without holding a lock while they sleep."""
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self._level = self.capacity
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount) -> float:
+        if self.rate <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._level = min(self.capacity, self._level + (now - self._stamp) * self.rate)
+            self._stamp = now
+            self._level -= amount
+            return 0.0 if self._level >= 0 else -self._level / self.rate
+
+    def refund(self, amount):
+        with self._lock:
+            self._level = min(self.capacity, self._level + min(amount, self.capacity))
+
+
+def estimate_content_tokens(content) -> int:
+    """Rough input size of a send_message payload: text at ~4 chars per
+    token, each image or uploaded file at IMAGE_TOKENS."""
+    parts = content if isinstance(content, list) else [content]
+    return sum(estimate_tokens(p) if isinstance(p, str) else IMAGE_TOKENS for p in parts)
+
+
+class ModelGateway:
+    def __init__(self, rpm=60, tpm=1_000_000, max_in_flight=8, max_retries=4,
+                 base_delay=1.0, max_delay=20.0, max_wait=60.0):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._inflight = Coalescer()
+
+    # ----------- admission ---------------------------------------------------
+
+    def _charge(self, tokens, deadline):
+        """Book one request and ``tokens`` in the buckets, waiting for them."""
+        wait = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+        if time.monotonic() + wait > deadline:
+            self.requests.refund(1)
+            self.tokens.refund(tokens)
+            raise ModelUnavailable("Model rate limit reached; try again shortly", retry_after=int(wait) + 1)
+        time.sleep(wait)
+
+    def _admit(self, kind, tokens, deadline):
+        """Wait for rate-limit budget and a concurrency slot."""
+        start = time.monotonic()
+        registry.add("model_gateway_queue_depth", 1)
+        try:
+            self._charge(tokens, deadline)
+            if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                raise ModelUnavailable("Too many model calls in flight; try again shortly")
+        finally:
+            registry.add("model_gateway_queue_depth", -1)
+            registry.observe("model_gateway_wait_seconds", time.monotonic() - start, kind=kind)
+        registry.add("model_gateway_in_flight", 1)
+
+    def _release(self):
+        registry.add("model_gateway_in_flight", -1)
+        self._slots.release()
+
+    def _backoff(self, kind, tokens, attempt, error):
+        """Sleep before a retry, then charge the retry to the buckets like
+        any other request (it keeps its concurrency slot)."""
+        if attempt >= self.max_retries:
+            registry.inc("model_gateway_calls_total", kind=kind, outcome="failed")
+            raise ModelUnavailable(f"Model unavailable after {attempt + 1} attempts: {error}") from error
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        registry.inc("model_gateway_retries_total", kind=kind, error=type(error).__name__)
+        print(f"Model call ({kind}) failed with {type(error).__name__}; retrying in {delay:.1f}s")
+        time.sleep(delay)
+        self._charge(tokens, time.monotonic() + self.max_wait)
+
+    # ----------- calls -------------------------------------------------------
+
+    def call(self, fn, *, kind="model", tokens=OUTPUT_TOKENS, key=None):
+        """Run ``fn()`` under the limits, retrying transient errors. Calls
+        with the same ``key`` that overlap share one result."""
+        if key is None:
+            return self._call(fn, kind, tokens)
+
+        result, shared = self._inflight.run(key, lambda: self._call(fn, kind, tokens))
+        if shared:
+            registry.inc("model_gateway_coalesced_total", kind=kind)
+        return result
+
+    def _call(self, fn, kind, tokens):
+        self._admit(kind, tokens, time.monotonic() + self.max_wait)
+        try:
+            attempt = 0
+            while True:
+                try:
+                    result = fn()
+                    registry.inc("model_gateway_calls_total", kind=kind, outcome="ok")
+                    return result
+                except TRANSIENT_ERRORS as e:
+                    self._backoff(kind, tokens, attempt, e)
+                    attempt += 1
+        finally:
+            self._release()
+
+    def send(self, chat, content, *, kind="chat", key=None):
+        """``chat.send_message(content)`` through the gateway."""
+        tokens = estimate_content_tokens(content) + OUTPUT_TOKENS
+        return self.call(lambda: chat.send_message(content), kind=kind, tokens=tokens, key=key)
+
+    def send_stream(self, chat, content, *, kind="chat_stream"):
+        """Streaming send. Only failures before the first chunk are retried;
+        once text has reached the client the stream is not restarted."""
+        tokens = estimate_content_tokens(content) + OUTPUT_TOKENS
+        self._admit(kind, tokens, time.monotonic() + self.max_wait)
+        try:
+            attempt = 0
+            while True:
+                try:
+                    chunks = iter(chat.send_message(content, stream=True))
+                    first = next(chunks, None)
+                    break
+                except TRANSIENT_ERRORS as e:
+                    self._backoff(kind, tokens, attempt, e)
+                    attempt += 1
+            if first is not None:
+                yield first
+                yield from chunks
+            registry.inc("model_gateway_calls_total", kind=kind, outcome="ok")
+        finally:
+            self._release()
@@ -0,0 +1,207 @@
+"""Upload ingestion: validate and normalize scans before they reach Gemini.
+
+The original bytes are archived untouched; the model gets a re-encoded copy
+that is metadata-free, capped at ``max_edge`` pixels on its longest side and
+saved as JPEG at ``quality``. That keeps multi-megabyte exports from
+inflating upload time and input tokens.
+
+A zipped DICOM series is assembled with the viewer's InstanceNumber loader
+and every axial slice is scored at once with NumPy; only the ``top_k`` most
+informative slices are encoded and sent, so a whole volume costs a few
+model inputs instead of hundreds.
+"""
+
+import io
+import os
+import tempfile
+import zipfile
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from viewer import load_scan_using_instance_number, sampled_contrast_limits, window_to_uint8
+
+# Refuse decompression bombs well before Pillow's own warning threshold.
+MAX_PIXELS = 64_000_000
+
+# Zipped series: limits on what we are willing to unpack.
+MAX_SERIES_FILES = 2000
+MAX_SERIES_BYTES = 2 * 1024 ** 3
+ENTROPY_BINS = 64
+SCORE_CHUNK = 32  # slices scored per vectorized block, bounding temporaries
+
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "BMP": ".bmp", "TIFF": ".tif", "WEBP": ".webp", "GIF": ".gif"}
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+@dataclass
+class NormalizedImage:
+    data: bytes
+    mime_type: str
+    original_mime_type: str
+    original_extension: str
+    width: int
+    height: int
+
+
+@dataclass
+class NormalizedSeries:
+    images: list  # NormalizedImage per selected slice, in slice order
+    slice_indices: list
+    scores: list  # score of each selected slice
+    shape: tuple  # (z, y, x) of the assembled volume
+    original_mime_type: str = "application/zip"
+    original_extension: str = ".zip"
+
+
+def normalize_image(data: bytes, max_edge=1024, quality=85) -> NormalizedImage:
+    try:
+        with Image.open(io.BytesIO(data)) as probe:
+            probe.verify()  # cheap structural check; the image is unusable after
+        img = Image.open(io.BytesIO(data))
+        fmt = img.format
+        if img.width * img.height > MAX_PIXELS:
+            raise InvalidImage(f"Image too large: {img.width}x{img.height}")
+        img = ImageOps.exif_transpose(img)  # bake in orientation before EXIF is dropped
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+        raise InvalidImage(f"Not a readable image: {e}") from e
+
+    if img.mode in ("I", "I;16", "I;16B", "F"):
+        # High bit-depth grayscale: stretch to 8 bits instead of clipping.
+        img = img.convert("F")
+        lo, hi = img.getextrema()
+        scale = 255.0 / (hi - lo) if hi > lo else 0.0
+        img = img.point(lambda v: (v - lo) * scale).convert("L")
+    elif img.mode not in ("L", "RGB"):
+        # MRI exports are usually grayscale; keep them single-channel.
+        img = img.convert("L" if img.mode in ("LA", "1") else "RGB")
+    img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    out = io.BytesIO()
+    # A fresh save without exif/icc arguments writes no metadata.
+    img.save(out, format="JPEG", quality=quality, optimize=True)
+    return NormalizedImage(
+        data=out.getvalue(),
+        mime_type="image/jpeg",
+        original_mime_type=Image.MIME.get(fmt, "application/octet-stream"),
+        original_extension=EXTENSIONS.get(fmt, ".img"),
+        width=img.width,
+        height=img.height,
+    )
+
+
+def make_thumbnail(data: bytes, edge=256, quality=80) -> bytes:
+    """Small JPEG for list views, from an already normalized image."""
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft(img.mode, (edge, edge))  # JPEG: decode at reduced scale
+        img = img.copy()
+    img.thumbnail((edge, edge), Image.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def is_series_archive(data: bytes) -> bool:
+    return zipfile.is_zipfile(io.BytesIO(data))
+
+
+def _extract_series(data: bytes, folder: str):
+    """Unpack regular files under numbered .dcm names (no paths kept)."""
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            members = [
+                m for m in zf.infolist()
+                if not m.is_dir()
+                and not os.path.basename(m.filename).startswith(".")
+                and not m.filename.startswith("__MACOSX/")
+            ]
+            if len(members) > MAX_SERIES_FILES:
+                raise InvalidImage(f"Series has {len(members)} files (max {MAX_SERIES_FILES})")
+            if sum(m.file_size for m in members) > MAX_SERIES_BYTES:
+                raise InvalidImage("Series is too large once unpacked")
+            for i, m in enumerate(members):
+                with zf.open(m) as src, open(os.path.join(folder, f"{i:05d}.dcm"), "wb") as dst:
+                    dst.write(src.read())
+    except zipfile.BadZipFile as e:
+        raise InvalidImage(f"Not a readable zip archive: {e}") from e
+
+
+def score_slices(volume, clim=None) -> np.ndarray:
+    """Informativeness of each axial slice: intensity variance, histogram
+    entropy and foreground fraction, each scaled to 0..1 across the volume,
+    combined as foreground * mean(variance, entropy)."""
+    lo, hi = clim or sampled_contrast_limits(volume)
+    n = volume.shape[0]
+    variance = np.empty(n)
+    entropy = np.empty(n)
+    foreground = np.empty(n)
+    threshold = lo + 0.1 * (hi - lo)
+    for start in range(0, n, SCORE_CHUNK):
+        block = np.asarray(volume[start:start + SCORE_CHUNK], dtype=np.float32)
+        rows = block.shape[0]
+        block = block.reshape(rows, -1)
+        variance[start:start + rows] = block.var(axis=1)
+        foreground[start:start + rows] = (block > threshold).mean(axis=1)
+        # One bincount for the whole block: offset each slice into its own bin range.
+        bins = np.clip((block - lo) * (ENTROPY_BINS / (hi - lo)), 0, ENTROPY_BINS - 1).astype(np.intp)
+        bins += (np.arange(rows) * ENTROPY_BINS)[:, None]
+        hist = np.bincount(bins.ravel(), minlength=rows * ENTROPY_BINS).reshape(rows, ENTROPY_BINS)
+        p = hist / block.shape[1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            entropy[start:start + rows] = -np.where(p > 0, p * np.log2(p), 0).sum(axis=1)
+
+    def unit(x):
+        top = x.max()
+        return x / top if top > 0 else x
+
+    return foreground * (unit(variance) + unit(entropy)) / 2
+
+
+def select_slices(scores, k) -> list:
+    """Indices of the ``k`` best slices, at least n / (2k) apart so the
+    picks spread through the volume instead of clustering."""
+    gap = max(1, len(scores) // (2 * k))
+    chosen = []
+    for i in np.argsort(scores)[::-1]:
+        if all(abs(int(i) - c) >= gap for c in chosen):
+            chosen.append(int(i))
+            if len(chosen) == k:
+                break
+    return sorted(chosen)
+
+
+def _slice_jpeg(plane, clim, max_edge, quality) -> NormalizedImage:
+    img = Image.fromarray(window_to_uint8(plane, clim), mode="L")
+    img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=quality, optimize=True)
+    return NormalizedImage(
+        data=out.getvalue(),
+        mime_type="image/jpeg",
+        original_mime_type="application/dicom",
+        original_extension=".dcm",
+        width=img.width,
+        height=img.height,
+    )
+
+
+def normalize_series(data: bytes, top_k=6, max_edge=1024, quality=85) -> NormalizedSeries:
+    with tempfile.TemporaryDirectory(prefix="series_") as folder:
+        _extract_series(data, folder)
+        volume, _ = load_scan_using_instance_number(folder, cache_dir=None)
+    if volume is None:
+        raise InvalidImage("No DICOM slices with InstanceNumber and pixel data in archive")
+
+    clim = sampled_contrast_limits(volume)
+    scores = score_slices(volume, clim)
+    indices = select_slices(scores, min(top_k, len(scores)))
+    return NormalizedSeries(
+        images=[_slice_jpeg(volume[i], clim, max_edge, quality) for i in indices],
+        slice_indices=indices,
+        scores=[round(float(scores[i]), 4) for i in indices],
+        shape=tuple(volume.shape),
+    )
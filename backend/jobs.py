@@ -0,0 +1,201 @@
+"""Background MRI analysis jobs.
+
+Submitted scans are recorded in a local SQLite file and run by a fixed
+number of worker threads, so a slow Gemini round-trip no longer pins a
+Flask worker.
+
+Several server processes may share one job DB. Each job row carries an
+owner (the process that queued or is running it) and a heartbeat the owner
+renews every ``lease / 3`` seconds. A worker claims a job with an atomic
+``UPDATE ... WHERE status = 'queued'``, so a job runs once. Jobs whose
+owner stopped renewing for ``lease`` seconds (the process died) are taken
+over by a live process, at start-up and then periodically.
+"""
+
+import itertools
+import json
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from sqlitedb import connect
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    def __init__(self, db_path, handler, workers=2, max_pending=100, lease=60.0):
+        """``handler(path)`` runs one job and returns its JSON-able result;
+        a result containing ``"error"`` marks the job failed."""
+        self.db_path = str(db_path)
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._pending = queue.PriorityQueue()
+        self._seq = itertools.count()  # FIFO among equal priorities
+        self._started = False
+        self._start_lock = threading.Lock()
+
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        with self._db() as db:
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                       id TEXT PRIMARY KEY,
+                       status TEXT NOT NULL,
+                       file_path TEXT NOT NULL,
+                       priority INTEGER NOT NULL DEFAULT 0,
+                       created_at REAL NOT NULL,
+                       started_at REAL,
+                       finished_at REAL,
+                       result TEXT,
+                       owner TEXT,
+                       heartbeat REAL
+                   )"""
+            )
+            columns = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (("owner", "TEXT"), ("heartbeat", "REAL")):
+                if column not in columns:  # DB created before leases
+                    db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status)")
+
+    def _db(self):
+        return connect(self.db_path)
+
+    def start(self):
+        """Start workers, take over jobs left by processes that are gone and
+        keep this process's leases alive."""
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+
+        recovered = self._recover()
+        if recovered:
+            print(f"Recovered {recovered} unfinished analysis jobs")
+
+        for i in range(self.workers):
+            threading.Thread(
+                target=self._work, name=f"analysis-worker-{i}", daemon=True
+            ).start()
+        threading.Thread(target=self._heartbeat, name="analysis-lease", daemon=True).start()
+
+    def _recover(self):
+        """Re-queue queued/running jobs whose owner's lease has expired."""
+        cutoff = time.time() - self.lease
+        with self._db() as db:
+            rows = db.execute(
+                "SELECT id, file_path, priority FROM jobs WHERE status IN (?, ?)"
+                " AND (heartbeat IS NULL OR heartbeat < ?) ORDER BY created_at",
+                (QUEUED, RUNNING, cutoff),
+            ).fetchall()
+        recovered = 0
+        for job_id, file_path, priority in rows:
+            with self._db() as db:
+                # Another live process may be recovering the same row.
+                taken = db.execute(
+                    "UPDATE jobs SET status = ?, owner = ?, heartbeat = ?, started_at = NULL"
+                    " WHERE id = ? AND status IN (?, ?) AND (heartbeat IS NULL OR heartbeat < ?)",
+                    (QUEUED, self.owner, time.time(), job_id, QUEUED, RUNNING, cutoff),
+                ).rowcount
+            if not taken:
+                continue
+            if Path(file_path).exists():
+                self._pending.put((priority, next(self._seq), job_id))
+                recovered += 1
+            else:
+                self._finish(job_id, FAILED, {"error": "Upload lost before restart"})
+        return recovered
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.lease / 3)
+            try:
+                with self._db() as db:
+                    db.execute(
+                        "UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status IN (?, ?)",
+                        (time.time(), self.owner, QUEUED, RUNNING),
+                    )
+                recovered = self._recover()
+                if recovered:
+                    print(f"Took over {recovered} analysis jobs from a stopped process")
+            except sqlite3.Error as e:
+                print(f"Job lease renewal failed: {e}")
+
+    def submit(self, file_path, priority=0, job_id=None):
+        """Queue ``file_path`` for analysis; lower ``priority`` runs first."""
+        self.start()
+        if self._pending.qsize() >= self.max_pending:
+            raise QueueFull(f"{self.max_pending} jobs already waiting")
+        job_id = job_id or uuid.uuid4().hex
+        with self._db() as db:
+            db.execute(
+                "INSERT INTO jobs (id, status, file_path, priority, created_at, owner, heartbeat)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, str(file_path), priority, time.time(), self.owner, time.time()),
+            )
+        self._pending.put((priority, next(self._seq), job_id))
+        return self.get(job_id)
+
+    def get(self, job_id):
+        self.start()
+        with self._db() as db:
+            row = db.execute(
+                "SELECT id, status, created_at, started_at, finished_at, result"
+                " FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(("job_id", "status", "created_at", "started_at", "finished_at"), row))
+        if row[5] is not None:
+            job["result"] = json.loads(row[5])
+        if job["status"] == QUEUED:
+            job["queue_depth"] = self._pending.qsize()
+        return job
+
+    def _set(self, job_id, **fields):
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        with self._db() as db:
+            db.execute(f"UPDATE jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+
+    def _finish(self, job_id, status, result):
+        self._set(
+            job_id, status=status, finished_at=time.time(), result=json.dumps(result)
+        )
+
+    def _work(self):
+        while True:
+            _, _, job_id = self._pending.get()
+            with self._db() as db:
+                claimed = db.execute(
+                    "UPDATE jobs SET status = ?, started_at = ?, heartbeat = ?"
+                    " WHERE id = ? AND owner = ? AND status = ?",
+                    (RUNNING, time.time(), time.time(), job_id, self.owner, QUEUED),
+                ).rowcount
+                row = db.execute(
+                    "SELECT file_path FROM jobs WHERE id = ?", (job_id,)
+                ).fetchone()
+            if not claimed:  # taken over by another process meanwhile
+                self._pending.task_done()
+                continue
+            path = Path(row[0])
+            try:
+                result = self.handler(path)
+                self._finish(job_id, FAILED if "error" in result else DONE, result)
+            except Exception as e:
+                print(f"Job {job_id} failed: {e}")
+                self._finish(job_id, FAILED, {"error": str(e)})
+            finally:
+                path.unlink(missing_ok=True)
+                self._pending.task_done()
@@ -0,0 +1,132 @@
+"""Latency spans and Prometheus-style metrics.
+
+``span(stage)`` times a block into the ``stage_duration_seconds`` histogram
+and, inside a Flask request, into that response's ``Server-Timing`` header.
+``render()`` produces the text served at ``/metrics``.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+
+# Upper bounds in seconds; spans range from sub-ms cache hits to model calls.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in sorted(labels.items()))
+    return "{" + inner + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines, cumulative = [], 0
+        for bound, n in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += n
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': bound})} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {self.sum:.6f}")
+        lines.append(f"{name}_count{_labels(labels)} {self.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._histograms = {}  # (name, frozen labels) -> Histogram
+        self._counters = {}  # (name, frozen labels) -> float
+        self._gauges = {}  # (name, frozen labels) -> float
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram()
+            hist.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def add(self, name, amount, **labels):
+        """Move a gauge (e.g. a queue depth) up or down."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + amount
+
+    def render(self) -> str:
+        with self._lock:
+            histograms = sorted(self._histograms.items(), key=lambda kv: kv[0])
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            lines, seen = [], set()
+            for (name, labels), hist in histograms:
+                if name not in seen:
+                    seen.add(name)
+                    if name in self._help:
+                        lines.append(f"# HELP {name} {self._help[name]}")
+                    lines.append(f"# TYPE {name} histogram")
+                lines.extend(hist.render(name, dict(labels)))
+            for kind, values in (("counter", counters), ("gauge", gauges)):
+                for (name, labels), value in values:
+                    if name not in seen:
+                        seen.add(name)
+                        if name in self._help:
+                            lines.append(f"# HELP {name} {self._help[name]}")
+                        lines.append(f"# TYPE {name} {kind}")
+                    lines.append(f"{name}{_labels(dict(labels))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+registry.describe("stage_duration_seconds", "Wall time of one pipeline, storage or model stage.")
+registry.describe("http_request_duration_seconds", "Wall time of Flask request handling.")
+
+
+@contextmanager
+def span(stage: str, timings: dict = None):
+    """Time a block under ``stage``. Also records it (in ms) into ``timings``
+    when given, and into Server-Timing when called inside a request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe("stage_duration_seconds", elapsed, stage=stage)
+        if timings is not None:
+            timings[stage] = round(elapsed * 1000, 1)
+        if has_request_context():
+            g.setdefault("server_timing", []).append((stage, elapsed))
+
+
+def server_timing_header(spans) -> str:
+    """Sum repeated stages (e.g. several storage gets) into one entry each."""
+    totals = {}
+    for stage, elapsed in spans:
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    return ", ".join(f"{stage};dur={secs * 1000:.1f}" for stage, secs in totals.items())
+
+
+def render() -> str:
+    return registry.render()
@@ -0,0 +1,234 @@
+"""CPU pre-screening classifier for uploaded MRI slices.
+
+A one-hidden-layer NumPy network over cheap image features (a normalized
+32x32 thumbnail, an intensity histogram and 4x4 cells of gradient-orientation
+histograms) predicts glioma/meningioma/notumor/pituitary in a few
+milliseconds. The app runs it before the Gemini call, stores its output next
+to the analysis, uses it for job priority and, when enabled, to answer
+confident ``notumor`` scans without a model call.
+
+    python prescreen.py train            # fit on data/Training, report on data/Testing
+    python prescreen.py eval
+    python prescreen.py bench --n 500
+"""
+
+import argparse
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from dataset import LABELS, label_images
+
+MODEL_PATH = Path(__file__).parent / "models" / "prescreen.npz"
+
+SIDE = 64  # working resolution for gradients
+THUMB = 32  # thumbnail fed to the model as raw pixels
+HIST_BINS = 16
+CELLS = 4  # CELLS x CELLS gradient histograms
+ORIENTATIONS = 8
+
+
+# ----------- FEATURES --------------------------------------------------------
+
+def image_features(img: Image.Image) -> np.ndarray:
+    img.draft("L", (2 * SIDE, 2 * SIDE))  # JPEG: decode at reduced scale
+    a = np.asarray(img.convert("L").resize((SIDE, SIDE), Image.BILINEAR), dtype=np.float32) / 255.0
+
+    f = SIDE // THUMB
+    thumb = a.reshape(THUMB, f, THUMB, f).mean(axis=(1, 3))
+    thumb = (thumb - thumb.mean()) / (thumb.std() + 1e-6)
+    hist = np.histogram(a, HIST_BINS, (0.0, 1.0))[0] / a.size
+
+    gy, gx = np.gradient(a)
+    magnitude = np.hypot(gx, gy)
+    orientation = np.minimum((np.arctan2(gy, gx) % np.pi) * (ORIENTATIONS / np.pi), ORIENTATIONS - 1).astype(np.intp)
+    cell = np.arange(SIDE) // (SIDE // CELLS)
+    bins = (cell[:, None] * CELLS + cell[None, :]) * ORIENTATIONS + orientation
+    hog = np.bincount(bins.ravel(), weights=magnitude.ravel(), minlength=CELLS * CELLS * ORIENTATIONS)
+    hog = hog.reshape(CELLS * CELLS, ORIENTATIONS)
+    hog /= np.linalg.norm(hog, axis=1, keepdims=True) + 1e-6
+
+    return np.concatenate([thumb.ravel(), hist, hog.ravel(), [a.mean(), a.std()]]).astype(np.float32)
+
+
+def features_from_bytes(data: bytes) -> np.ndarray:
+    with Image.open(io.BytesIO(data)) as img:
+        return image_features(img)
+
+
+def _features_from_path(path):
+    with Image.open(path) as img:
+        return image_features(img)
+
+
+def collect_split(split, limit=None):
+    """(paths, label indices) for data/<split>/<label>/*, ``limit`` per label."""
+    paths, y = [], []
+    for i, label in enumerate(LABELS):
+        files = label_images(split, label, limit)
+        paths += files
+        y += [i] * len(files)
+    return paths, y
+
+
+def load_split(split, limit=None, workers=8):
+    paths, y = collect_split(split, limit)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        X = np.stack(list(pool.map(_features_from_path, paths)))
+    return X, np.array(y), paths
+
+
+# ----------- MODEL -----------------------------------------------------------
+
+def _softmax(z):
+    z = z - z.max(axis=1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=1, keepdims=True)
+
+
+class Prescreener:
+    def __init__(self, w1, b1, w2, b2, mean, std, labels=LABELS):
+        self.w1, self.b1, self.w2, self.b2 = w1, b1, w2, b2
+        self.mean, self.std = mean, std
+        self.labels = tuple(labels)
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        with np.load(path) as m:
+            return cls(m["w1"], m["b1"], m["w2"], m["b2"], m["mean"], m["std"], [str(l) for l in m["labels"]])
+
+    def save(self, path=MODEL_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            path, w1=self.w1, b1=self.b1, w2=self.w2, b2=self.b2,
+            mean=self.mean, std=self.std, labels=np.array(self.labels),
+        )
+
+    def _hidden(self, X):
+        return np.maximum(((X - self.mean) / self.std) @ self.w1 + self.b1, 0)
+
+    def predict_proba(self, X) -> np.ndarray:
+        return _softmax(self._hidden(X) @ self.w2 + self.b2)
+
+    def predict(self, images) -> dict:
+        """Classify one image's bytes, or several slices of one scan (their
+        probabilities are averaged)."""
+        start = time.perf_counter()
+        if isinstance(images, bytes):
+            images = [images]
+        probs = self.predict_proba(np.stack([features_from_bytes(b) for b in images])).mean(axis=0)
+        best = int(probs.argmax())
+        return {
+            "label": self.labels[best],
+            "confidence": round(float(probs[best]), 4),
+            "probabilities": {l: round(float(p), 4) for l, p in zip(self.labels, probs)},
+            "ms": round((time.perf_counter() - start) * 1000, 2),
+        }
+
+
+def train(X, y, hidden=64, epochs=60, lr=1e-3, l2=1e-3, batch_size=128, seed=0) -> Prescreener:
+    """Minibatch Adam on softmax cross-entropy with L2 on the weights."""
+    rng = np.random.default_rng(seed)
+    mean, std = X.mean(axis=0), X.std(axis=0) + 1e-6
+    Xs = (X - mean) / std
+    Y = np.eye(len(LABELS), dtype=np.float32)[y]
+    n_in = X.shape[1]
+    params = [
+        rng.normal(0, np.sqrt(2 / n_in), (n_in, hidden)).astype(np.float32),
+        np.zeros(hidden, np.float32),
+        rng.normal(0, np.sqrt(1 / hidden), (hidden, len(LABELS))).astype(np.float32),
+        np.zeros(len(LABELS), np.float32),
+    ]
+    m = [np.zeros_like(p) for p in params]
+    v = [np.zeros_like(p) for p in params]
+    step = 0
+    for epoch in range(epochs):
+        order = rng.permutation(len(Xs))
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            xb = Xs[idx]
+            h = np.maximum(xb @ params[0] + params[1], 0)
+            g = (_softmax(h @ params[2] + params[3]) - Y[idx]) / len(idx)
+            gh = (g @ params[2].T) * (h > 0)
+            grads = [xb.T @ gh + l2 * params[0], gh.sum(axis=0), h.T @ g + l2 * params[2], g.sum(axis=0)]
+            step += 1
+            for p, gp, mp, vp in zip(params, grads, m, v):
+                mp[...] = 0.9 * mp + 0.1 * gp
+                vp[...] = 0.999 * vp + 0.001 * gp * gp
+                p -= lr * (mp / (1 - 0.9 ** step)) / (np.sqrt(vp / (1 - 0.999 ** step)) + 1e-8)
+    return Prescreener(*params, mean.astype(np.float32), std.astype(np.float32))
+
+
+# ----------- CLI -------------------------------------------------------------
+
+def evaluate(model, X, y):
+    pred = model.predict_proba(X).argmax(axis=1)
+    print(f"\n{'label':<12}{'n':>6}{'accuracy':>10}   predicted as")
+    for i, label in enumerate(LABELS):
+        mask = y == i
+        counts = np.bincount(pred[mask], minlength=len(LABELS))
+        spread = ", ".join(f"{LABELS[j]}={c}" for j, c in enumerate(counts) if c)
+        print(f"{label:<12}{mask.sum():>6}{(pred[mask] == i).mean():>10.1%}   {spread}")
+    print(f"{'overall':<12}{len(y):>6}{(pred == y).mean():>10.1%}")
+    notumor = LABELS.index("notumor")
+    missed = int(((pred == notumor) & (y != notumor)).sum())
+    print(f"Tumors predicted as notumor: {missed} of {(y != notumor).sum()}")
+
+
+def bench(model, paths, n):
+    paths = [paths[i % len(paths)] for i in range(n)]
+    blobs = [p.read_bytes() for p in paths]
+    latencies = []
+    start = time.perf_counter()
+    for data in blobs:
+        t = time.perf_counter()
+        model.predict(data)
+        latencies.append((time.perf_counter() - t) * 1000)
+    wall = time.perf_counter() - start
+    latencies.sort()
+    print(
+        f"Single image (decode + features + inference): {n / wall:.0f} images/s, "
+        f"p50 {latencies[n // 2]:.2f} ms, p99 {latencies[int(n * 0.99)]:.2f} ms"
+    )
+    X = np.stack([features_from_bytes(b) for b in blobs])
+    t = time.perf_counter()
+    model.predict_proba(X)
+    print(f"Batched inference only: {n / (time.perf_counter() - t):.0f} images/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("command", choices=["train", "eval", "bench"])
+    parser.add_argument("--model", type=Path, default=MODEL_PATH)
+    parser.add_argument("--hidden", type=int, default=64)
+    parser.add_argument("--epochs", type=int, default=60)
+    parser.add_argument("--limit", type=int, help="Max images per label.")
+    parser.add_argument("--n", type=int, default=500, help="Images to time in bench.")
+    args = parser.parse_args()
+
+    if args.command == "train":
+        t = time.perf_counter()
+        X, y, _ = load_split("Training", args.limit)
+        print(f"Extracted {X.shape[1]} features from {len(X)} training images in {time.perf_counter() - t:.1f}s")
+        t = time.perf_counter()
+        model = train(X, y, hidden=args.hidden, epochs=args.epochs)
+        print(f"Trained in {time.perf_counter() - t:.1f}s")
+        model.save(args.model)
+        print(f"Saved {args.model}")
+    else:
+        model = Prescreener.load(args.model)
+
+    if args.command in ("train", "eval"):
+        X, y, _ = load_split("Testing", args.limit)
+        evaluate(model, X, y)
+    if args.command == "bench":
+        paths, _ = collect_split("Testing", limit=args.n // len(LABELS) + 1)
+        bench(model, paths, args.n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Run IDs ("timestamps") and the keys and bounds derived from them.
+
+Run IDs are YYYYMMDD_HHMMSS_<microseconds>_<random hex>, unique across
+concurrent runs and still ordered by time. Runs archived before that have
+the bare YYYYMMDD_HHMMSS form; both forms are accepted everywhere.
+"""
+
+import re
+import uuid
+from datetime import datetime
+
+# One small manifest per run lives under this prefix so /history can page
+# through runs without listing or downloading the whole saved/ archive.
+HISTORY_PREFIX = "index/history/"
+
+RUN_ID_PATTERN = r"\d{8}_\d{6}(?:_\d{6}_[0-9a-f]{4})?"
+TIMESTAMP_RE = re.compile(f"^{RUN_ID_PATTERN}$")
+
+
+def new_run_id() -> str:
+    return f"{datetime.now():%Y%m%d_%H%M%S_%f}_{uuid.uuid4().hex[:4]}"
+
+
+def run_time(ts: str) -> datetime:
+    return datetime.strptime(ts[:15], "%Y%m%d_%H%M%S")
+
+
+def history_key(ts: str) -> str:
+    """Index key for a run. S3 lists keys in ascending order, so the
+    timestamp is inverted to make the newest run sort first (seconds, then
+    microseconds for runs within the same second)."""
+    date, clock, *rest = ts.split("_")
+    inverted = 99999999999999 - int(date + clock)
+    if not rest:  # run archived before sub-second IDs
+        return f"{HISTORY_PREFIX}{inverted:014d}_{ts}.json"
+    return f"{HISTORY_PREFIX}{inverted:014d}_{999999 - int(rest[0]):06d}_{ts}.json"
+
+
+def history_key_timestamp(key: str) -> str:
+    return re.search(f"({RUN_ID_PATTERN})\\.json$", key).group(1)
+
+
+def search_bound(value, end=False):
+    """A run ID, or a YYYY-MM-DD date widened to the whole day. An ``end``
+    of second resolution covers that whole second. Bounds compare as
+    strings: "_000000" sorts before any run of the day, "_999999" after."""
+    if TIMESTAMP_RE.match(value):
+        return f"{value}_999999_ffff" if end and len(value) == 15 else value
+    day = datetime.strptime(value, "%Y-%m-%d").strftime("%Y%m%d")
+    return f"{day}_999999" if end else f"{day}_000000"
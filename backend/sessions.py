@@ -0,0 +1,121 @@
+"""Server-side multi-turn chat sessions.
+
+Each session wraps one Gemini ``ChatSession`` for a single analysis. The
+analysis context is sent once, as compact JSON, in the opening turn; later
+messages carry only the user's question. When the estimated history size
+passes ``token_budget``, the older turns are folded into a short summary so
+the per-turn input cost stays bounded.
+"""
+
+import json
+import threading
+import uuid
+
+from cache import LRUCache
+
+CONTEXT_INTRO = (
+    "You are a medical AI assistant. Answer questions about the MRI analysis "
+    "below clearly and concisely, no markdown.\n"
+)
+
+
+def compact_json(obj) -> str:
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token is close enough for budgeting and costs no
+    # extra count_tokens round-trip.
+    return len(text) // 4 + 1
+
+
+class ChatSession:
+    def __init__(self, session_id, ts, context, chat):
+        self.session_id = session_id
+        self.timestamp = ts
+        self.context = context
+        self.chat = chat
+        self.summary = None  # folded-in older turns, once compacted
+        self.lock = threading.Lock()  # one in-flight turn per session
+
+
+class ChatSessions:
+    def __init__(self, model, gateway, max_sessions=500, idle_ttl=1800, token_budget=8000, keep_turns=4):
+        self.model = model
+        self.gateway = gateway  # rate limits and retries every call (gateway.py)
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        # Sessions are re-set after every turn, so the TTL acts as idle expiry.
+        self._sessions = LRUCache(maxsize=max_sessions, ttl=idle_ttl)
+
+    def create(self, ts, context):
+        session_id = uuid.uuid4().hex
+        chat = self.model.start_chat(history=self._preamble(context))
+        self._sessions.set(session_id, ChatSession(session_id, ts, context, chat))
+        return session_id
+
+    def get(self, session_id, ts=None):
+        """The session, or None if unknown, expired or opened on a run
+        other than ``ts``. Sessions remember their run, so callers need not
+        resend it."""
+        session = self._sessions.get(session_id)
+        if session is None or (ts and ts != session.timestamp):
+            return None
+        return session
+
+    def send(self, session, message) -> str:
+        with session.lock:
+            text = self.gateway.send(session.chat, message, kind="chat_session").text
+            self._compact(session)
+        self._sessions.set(session.session_id, session)
+        return text
+
+    def send_stream(self, session, message):
+        """Yield response chunks; the turn is committed once fully consumed.
+
+        A stream that fails or is abandoned by the client leaves the chat
+        holding an unfinished response, which breaks every later turn, so
+        the session is dropped and the next request gets a 404."""
+        with session.lock:
+            try:
+                yield from self.gateway.send_stream(session.chat, message, kind="chat_session_stream")
+                self._compact(session)
+            except BaseException:  # includes GeneratorExit on disconnect
+                self._sessions.pop(session.session_id)
+                print(f"Dropped chat session {session.session_id} after an unfinished turn")
+                raise
+        self._sessions.set(session.session_id, session)
+
+    def _preamble(self, context, summary=None):
+        text = CONTEXT_INTRO + compact_json(context)
+        if summary:
+            text += "\nSummary of the conversation so far: " + summary
+        return [
+            {"role": "user", "parts": [text]},
+            {"role": "model", "parts": ["Understood."]},
+        ]
+
+    def _compact(self, session):
+        history = [
+            {"role": c.role, "parts": [p.text for p in c.parts]}
+            for c in session.chat.history
+        ]
+        size = sum(estimate_tokens(t) for turn in history for t in turn["parts"])
+        keep = 2 * self.keep_turns
+        if size <= self.token_budget or len(history) <= 2 + keep:
+            return
+
+        older, recent = history[2:-keep], history[-keep:]
+        transcript = "\n".join(f"{t['role']}: {' '.join(t['parts'])}" for t in older)
+        if session.summary:
+            transcript = f"(earlier) {session.summary}\n{transcript}"
+        session.summary = self.gateway.send(
+            self.model.start_chat(),
+            "Summarize this conversation about an MRI analysis in at most "
+            "5 sentences, keeping any facts the user was told:\n" + transcript,
+            kind="chat_compact",
+        ).text.strip()
+        session.chat = self.model.start_chat(
+            history=self._preamble(session.context, session.summary) + recent
+        )
+        print(f"Compacted chat session {session.session_id}: ~{size} tokens")
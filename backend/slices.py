@@ -0,0 +1,143 @@
+"""Headless slice and MIP rendering for DICOM series.
+
+Each scan directory is loaded once through the viewer's loader (which keeps
+a memory-mapped copy on disk) and held in a small LRU of volumes. Axial,
+coronal and sagittal slices and maximum-intensity projections are windowed
+to 8 bits, optionally marked at the tumor coordinates, encoded as PNG and
+kept in a tile cache, so repeat requests never touch the volume again.
+"""
+
+import io
+import os
+import re
+import threading
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from cache import LRUCache
+from viewer import (
+    DEFAULT_CACHE_DIR,
+    load_scan_using_instance_number,
+    sampled_contrast_limits,
+    window_to_uint8,
+)
+
+AXES = {"axial": 0, "coronal": 1, "sagittal": 2}
+SCAN_NAME_RE = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]*$")
+MARKER_RADIUS = 10  # same 20 px diameter as the napari viewer's default marker
+MARKER_COLOR = (255, 0, 0)
+
+
+class ScanVolume:
+    def __init__(self, name, version, data):
+        self.name = name
+        self.version = version  # directory mtime; a changed series gets a new entry
+        self.data = data
+        self.clim = sampled_contrast_limits(data)
+        self._mips = {}
+        self._lock = threading.Lock()
+
+    def mip(self, axis):
+        with self._lock:
+            if axis not in self._mips:
+                self._mips[axis] = np.asarray(self.data).max(axis=axis)
+            return self._mips[axis]
+
+
+def _plane_position(axis, marker):
+    """(column, row, depth) of a volume-space marker (x, y, z) on an ``axis`` plane."""
+    x, y, z = marker
+    return {0: (x, y, z), 1: (x, z, y), 2: (y, z, x)}[axis]
+
+
+def _to_png(pixels, axis, marker, depth=None):
+    img = Image.fromarray(pixels, mode="L")
+    if marker is not None:
+        col, row, marker_depth = _plane_position(axis, marker)
+        # Slices show the cross-section of a sphere; projections show all of it.
+        offset = 0 if depth is None else abs(depth - marker_depth)
+        if offset < MARKER_RADIUS:
+            r = (MARKER_RADIUS ** 2 - offset ** 2) ** 0.5
+            img = img.convert("RGB")
+            ImageDraw.Draw(img).ellipse((col - r, row - r, col + r, row + r), outline=MARKER_COLOR, width=2)
+    out = io.BytesIO()
+    img.save(out, format="PNG", compress_level=1)  # speed over size for interactive browsing
+    return out.getvalue()
+
+
+class SliceRenderer:
+    def __init__(self, scans_dir, max_volumes=4, max_tiles=1024, cache_dir=DEFAULT_CACHE_DIR):
+        self.scans_dir = os.path.realpath(scans_dir)
+        self.cache_dir = cache_dir
+        self._volumes = LRUCache(maxsize=max_volumes)
+        self._tiles = LRUCache(maxsize=max_tiles)
+        self._load_locks = {}
+        self._lock = threading.Lock()
+
+    def _scan_path(self, name):
+        path = os.path.realpath(os.path.join(self.scans_dir, name))
+        if not SCAN_NAME_RE.match(name) or os.path.dirname(path) != self.scans_dir:
+            raise FileNotFoundError(name)
+        if not os.path.isdir(path):
+            raise FileNotFoundError(name)
+        return path
+
+    def volume(self, name) -> ScanVolume:
+        """Load (or reuse) a scan; concurrent first requests share one load."""
+        path = self._scan_path(name)
+        version = os.stat(path).st_mtime_ns
+        vol = self._volumes.get(name)
+        if vol is not None and vol.version == version:
+            return vol
+        with self._lock:
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        with load_lock:
+            vol = self._volumes.get(name)
+            if vol is not None and vol.version == version:
+                return vol
+            data, _ = load_scan_using_instance_number(path, cache_dir=self.cache_dir)
+            if data is None:
+                raise ValueError(f"No readable DICOM series in scan '{name}'")
+            vol = ScanVolume(name, version, data)
+            self._volumes.set(name, vol)
+            return vol
+
+    def info(self, name) -> dict:
+        vol = self.volume(name)
+        return {
+            "scan": name,
+            "shape": dict(zip(("z", "y", "x"), vol.data.shape)),
+            "slices": {axis: vol.data.shape[i] for axis, i in AXES.items()},
+            "contrast_limits": vol.clim,
+        }
+
+    def slice_png(self, name, axis_name, index, marker=None) -> bytes:
+        vol = self.volume(name)
+        axis = self._axis(axis_name)
+        if not 0 <= index < vol.data.shape[axis]:
+            raise IndexError(f"{axis_name} slice {index} out of range 0..{vol.data.shape[axis] - 1}")
+        key = (name, vol.version, "slice", axis, index, marker)
+        png = self._tiles.get(key)
+        if png is None:
+            plane = np.take(vol.data, index, axis=axis)
+            png = _to_png(window_to_uint8(plane, vol.clim), axis, marker, depth=index)
+            self._tiles.set(key, png)
+        return png
+
+    def mip_png(self, name, axis_name, marker=None) -> bytes:
+        vol = self.volume(name)
+        axis = self._axis(axis_name)
+        key = (name, vol.version, "mip", axis, marker)
+        png = self._tiles.get(key)
+        if png is None:
+            png = _to_png(window_to_uint8(vol.mip(axis), vol.clim), axis, marker)
+            self._tiles.set(key, png)
+        return png
+
+    @staticmethod
+    def _axis(axis_name):
+        try:
+            return AXES[axis_name]
+        except KeyError:
+            raise ValueError(f"axis must be one of {', '.join(AXES)}") from None
@@ -0,0 +1,17 @@
+"""SQLite access shared by the job queue and the run catalog."""
+
+import sqlite3
+from contextlib import contextmanager
+
+
+@contextmanager
+def connect(db_path):
+    """A connection for one operation, committed on success and rolled back
+    on error. One short-lived connection per operation keeps callers
+    thread-safe without sharing a connection between threads."""
+    db = sqlite3.connect(str(db_path), timeout=30)
+    try:
+        with db:
+            yield db
+    finally:
+        db.close()
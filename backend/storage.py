@@ -0,0 +1,192 @@
+"""Object storage for the saved/ archive and its indexes.
+
+Two interchangeable backends share one small interface
+(put/get/list/url/signed_url):
+
+- ``S3Storage``    – the production bucket, one long-lived pooled client.
+- ``LocalStorage`` – the same key layout under a directory on disk, for
+                     on-prem deployments and load tests without S3.
+
+``get_storage()`` returns the process-wide instance picked by
+``STORAGE_BACKEND`` (``s3`` or ``local``).
+"""
+
+import itertools
+import os
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+
+class S3Storage:
+    def __init__(self, bucket, region, access_key, secret_key, max_pool_connections=32):
+        import boto3
+        from botocore.config import Config
+
+        self.bucket = bucket
+        # boto3 clients are thread-safe once built; building one per call is
+        # what costs credential resolution and a fresh connection pool.
+        self.client = boto3.session.Session().client(
+            "s3",
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            region_name=region,
+            config=Config(
+                max_pool_connections=max_pool_connections,
+                retries={"max_attempts": 3, "mode": "standard"},
+            ),
+        )
+
+    def put(self, key, body, content_type):
+        self.client.put_object(
+            Bucket=self.bucket, Key=key, Body=body, ContentType=content_type
+        )
+
+    def get(self, key) -> bytes:
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=key)
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(key)
+        return obj["Body"].read()
+
+    def list(self, prefix, start_after=None, max_keys=1000):
+        """Return ``(objects, truncated)``; objects are dicts with ``Key`` and
+        ``LastModified`` in ascending key order, like ``list_objects_v2``."""
+        params = dict(Bucket=self.bucket, Prefix=prefix, MaxKeys=max_keys)
+        if start_after:
+            params["StartAfter"] = start_after
+        resp = self.client.list_objects_v2(**params)
+        objs = [
+            {"Key": o["Key"], "LastModified": o["LastModified"], "ETag": o["ETag"]}
+            for o in resp.get("Contents", [])
+        ]
+        return objs, bool(resp.get("IsTruncated"))
+
+    def iter_keys(self, prefix):
+        for page in self.client.get_paginator("list_objects_v2").paginate(
+            Bucket=self.bucket, Prefix=prefix
+        ):
+            for obj in page.get("Contents", []):
+                yield obj["Key"]
+
+    def url(self, key):
+        return f"https://{self.bucket}.s3.amazonaws.com/{key}"
+
+    def signed_url(self, key, expires):
+        """Time-limited GET URL; signed locally, no request to S3."""
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": key}, ExpiresIn=expires
+        )
+
+
+class LocalStorage:
+    def __init__(self, root, public_base_url):
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.public_base_url = public_base_url.rstrip("/")
+
+    def _path(self, key):
+        path = (self.root / key).resolve()
+        if self.root not in path.parents:
+            raise ValueError(f"Key escapes storage root: {key}")
+        return path
+
+    def put(self, key, body, content_type):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if hasattr(body, "read"):
+            body = body.read()
+        if isinstance(body, str):
+            body = body.encode()
+        # Write-then-rename so concurrent readers never see a partial object.
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(body)
+        os.replace(tmp, path)
+
+    def get(self, key) -> bytes:
+        return self._path(key).read_bytes()
+
+    def _walk(self, prefix, start_after=None):
+        """Keys under ``prefix`` in ascending order (S3's), generated lazily.
+        Subdirectories that can only hold keys at or before ``start_after``
+        are skipped, so a page costs reading and sorting the names of the
+        directories it touches, not the whole prefix."""
+        def walk(path, rel):
+            try:
+                entries = list(os.scandir(path))
+            except FileNotFoundError:
+                return
+            # A directory sorts as "name/", so the walk order is key order.
+            named = sorted(
+                (e.name + "/" if e.is_dir() else e.name, e)
+                for e in entries if not e.name.startswith(".")
+            )
+            for name, entry in named:
+                key = rel + name
+                if name.endswith("/"):
+                    if not (key.startswith(prefix) or prefix.startswith(key)):
+                        continue
+                    if start_after and key < start_after and not start_after.startswith(key):
+                        continue  # everything below sorts before start_after
+                    yield from walk(entry.path, key)
+                elif key.startswith(prefix) and (not start_after or key > start_after):
+                    yield key
+
+        base = prefix.rpartition("/")[0]
+        return walk(self.root / base, f"{base}/" if base else "")
+
+    def list(self, prefix, start_after=None, max_keys=1000):
+        keys = list(itertools.islice(self._walk(prefix, start_after), max_keys + 1))
+        objs = [
+            {
+                "Key": k,
+                "LastModified": datetime.fromtimestamp(
+                    self._path(k).stat().st_mtime, tz=timezone.utc
+                ),
+            }
+            for k in keys[:max_keys]
+        ]
+        return objs, len(keys) > max_keys
+
+    def iter_keys(self, prefix):
+        return self._walk(prefix)
+
+    def url(self, key):
+        return f"{self.public_base_url}/files/{key}"
+
+    def signed_url(self, key, expires):
+        return self.url(key)  # /files serves the archive directly
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Process-wide storage backend, built on first use from the environment."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = _build_storage()
+    return _storage
+
+
+def _build_storage():
+    backend = os.environ.get("STORAGE_BACKEND", "s3").lower()
+    if backend == "local":
+        return LocalStorage(
+            os.environ.get(
+                "LOCAL_STORAGE_DIR", Path(__file__).parent / "local_storage"
+            ),
+            os.environ.get("PUBLIC_BASE_URL", "http://localhost:5000"),
+        )
+    if backend == "s3":
+        return S3Storage(
+            os.environ["S3_BUCKET_NAME"],
+            os.environ["AWS_REGION"],
+            os.environ["AWS_ACCESS_KEY"],
+            os.environ["AWS_SECRET_KEY"],
+            max_pool_connections=int(os.environ.get("S3_MAX_POOL_CONNECTIONS", 32)),
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
@@ -0,0 +1,200 @@
+import json
+
+import pytest
+
+from analysis import (
+    AnalysisError,
+    _coordinates,
+    _double_quote,
+    _repair_text,
+    analysis_from_dict,
+    parse_analysis,
+    reask_prompt,
+    tumor_marker,
+)
+
+VALID = {
+    "tumor_detection": {
+        "present": True,
+        "type": "glioma",
+        "location": "left temporal lobe",
+        "size": "2.1 cm",
+        "characteristics": "heterogeneous enhancement",
+        "coordinates": {"x": 180, "y": 95, "z": 140},
+    },
+    "gray_matter_assessment": {"loss_detected": False, "regions_affected": [], "severity": "none"},
+    "other_abnormalities": [],
+    "recommended_follow_up": ["Contrast-enhanced MRI"],
+}
+
+
+# ----------- _repair_text ----------------------------------------------------
+
+def test_repair_strips_fences_and_surrounding_prose():
+    raw = "Here is the analysis:\n```json\n{\"a\": 1}\n```\nLet me know."
+    assert json.loads(_repair_text(raw)) == {"a": 1}
+
+
+def test_repair_drops_trailing_commas():
+    assert json.loads(_repair_text('{"a": [1, 2, ], "b": {"c": 3,},}')) == {"a": [1, 2], "b": {"c": 3}}
+
+
+def test_repair_drops_line_comments_but_not_urls_in_strings():
+    raw = '{\n  // reasoning\n  "ref": "http://example.org/a", // trailing note\n  "b": 1\n}'
+    assert json.loads(_repair_text(raw)) == {"ref": "http://example.org/a", "b": 1}
+
+
+def test_repair_converts_python_literals_outside_strings_only():
+    raw = '{"present": True, "type": None, "loss": False, "notes": ["None seen", "True to form"]}'
+    assert json.loads(_repair_text(raw)) == {
+        "present": True, "type": None, "loss": False, "notes": ["None seen", "True to form"],
+    }
+
+
+def test_repair_keeps_commas_and_brackets_inside_strings():
+    raw = '{"size": "2 cm, }", "list": ["a, ]",],}'
+    assert json.loads(_repair_text(raw)) == {"size": "2 cm, }", "list": ["a, ]"]}
+
+
+def test_repair_leaves_valid_json_unchanged():
+    text = json.dumps(VALID)
+    assert _repair_text(text) == text
+
+
+# ----------- single quotes ---------------------------------------------------
+
+def test_double_quote_converts_python_repr():
+    text = _repair_text(repr({"present": True, "type": "glioma", "coordinates": [1, 2, 3]}))
+    assert json.loads(_double_quote(text)) == {"present": True, "type": "glioma", "coordinates": [1, 2, 3]}
+
+
+def test_double_quote_handles_apostrophes_and_quotes():
+    # repr() switches to double quotes for strings containing an apostrophe.
+    value = {"note": "patient's scan", "quote": 'said "fine"', "escaped": "it's"}
+    assert json.loads(_double_quote(repr(value))) == value
+    assert json.loads(_double_quote("{'a': 'it\\'s'}")) == {"a": "it's"}
+
+
+def test_double_quote_keeps_none_text_in_single_quoted_strings():
+    text = _repair_text("{'severity': 'None', 'x': None}")
+    assert json.loads(_double_quote(text)) == {"severity": "None", "x": None}
+
+
+# ----------- _coordinates ----------------------------------------------------
+
+@pytest.mark.parametrize("value, expected", [
+    ({"x": 1, "y": 2, "z": 3}, (1.0, 2.0, 3.0)),
+    ({"X": "120 px", "Y": "95", "Z": -4.5}, (120.0, 95.0, -4.5)),
+    ([10, "20 px", 30], (10.0, 20.0, 30.0)),
+    ("x=120, y=95, z=140", (120.0, 95.0, 140.0)),
+    ("(1.5, 2, 3)", (1.5, 2.0, 3.0)),
+])
+def test_coordinates_coerced(value, expected):
+    problems = []
+    coords = _coordinates(value, problems)
+    assert (coords.x, coords.y, coords.z) == expected
+    assert problems == []
+
+
+@pytest.mark.parametrize("value", [
+    None, "", {}, [], "not determinable", {"x": "n/a", "y": "n/a", "z": "n/a"}, [None, None, None],
+])
+def test_coordinates_without_numbers_mean_none(value):
+    problems = []
+    assert _coordinates(value, problems) is None
+    assert problems == []
+
+
+@pytest.mark.parametrize("value", [
+    {"x": 1, "y": 2},
+    {"x": "left", "y": 2, "z": 3},
+    [1, 2],
+    [1, 2, 3, 4],
+    "x=120, y=95",
+    {"x": True, "y": 2, "z": 3},
+    42,
+])
+def test_coordinates_unusable_reported(value):
+    problems = []
+    assert _coordinates(value, problems) is None
+    assert len(problems) == 1 and "coordinates" in problems[0]
+    assert repr(value) in problems[0]  # the model's value, not an intermediate
+
+
+# ----------- parse_analysis --------------------------------------------------
+
+def test_parse_valid_reply_needs_no_repair():
+    record, repaired = parse_analysis(json.dumps(VALID))
+    assert not repaired
+    assert record.to_dict()["tumor_detection"]["coordinates"] == {"x": 180.0, "y": 95.0, "z": 140.0}
+
+
+def test_parse_repairs_fenced_python_repr():
+    raw = "```json\n" + repr(VALID) + "\n```"
+    record, repaired = parse_analysis(raw)
+    assert repaired
+    assert record.tumor_detection.type == "glioma"
+    assert record.tumor_marker() == (180.0, 95.0, 140.0)
+
+
+def test_parse_coerces_loose_values():
+    reply = {
+        "tumor_detection": {"present": "yes", "type": "Likely Meningioma", "coordinates": "120, 95, 140"},
+        "gray_matter_assessment": "mild loss in the frontal lobe",
+        "other_abnormalities": "None",
+        "recommended_follow_up": "Neurosurgical consult",
+    }
+    record, _ = parse_analysis(json.dumps(reply))
+    assert record.tumor_detection.present is True
+    assert record.tumor_detection.type == "meningioma"
+    assert record.gray_matter_assessment.severity == "mild loss in the frontal lobe"
+    assert record.other_abnormalities == []
+    assert record.recommended_follow_up == ["Neurosurgical consult"]
+
+
+def test_parse_present_tumor_without_position_is_not_a_problem():
+    reply = {**VALID, "tumor_detection": {"present": True, "type": "glioma", "coordinates": "not determinable"}}
+    record, _ = parse_analysis(json.dumps(reply))
+    assert record.tumor_detection.coordinates is None and record.tumor_marker() is None
+
+
+def test_parse_absent_tumor_ignores_type_and_coordinates():
+    reply = {**VALID, "tumor_detection": {"present": False, "type": "glioma", "coordinates": "n/a"}}
+    record, _ = parse_analysis(json.dumps(reply))
+    assert record.tumor_detection.type is None and record.tumor_marker() is None
+
+
+@pytest.mark.parametrize("raw, problem", [
+    ("I could not analyze this image.", "not valid JSON"),
+    ("[1, 2, 3]", "expected a JSON object"),
+    ('{"gray_matter_assessment": {}}', "tumor_detection object is missing"),
+    ('{"tumor_detection": {"present": "maybe"}}', "tumor_detection.present must be true or false"),
+    ('{"tumor_detection": {"present": true, "coordinates": {"x": 1}}}', "coordinates"),
+])
+def test_parse_unusable_reply_lists_problems(raw, problem):
+    with pytest.raises(AnalysisError) as exc:
+        parse_analysis(raw)
+    assert any(problem in p for p in exc.value.problems)
+
+
+def test_reask_prompt_carries_problems_and_reply():
+    error = AnalysisError(["tumor_detection.present is missing"])
+    prompt = reask_prompt(error, '{"tumor_detection": {}}')
+    assert "tumor_detection.present is missing" in prompt
+    assert prompt.endswith('{"tumor_detection": {}}')
+
+
+# ----------- tumor_marker ----------------------------------------------------
+
+def test_tumor_marker_reads_legacy_contexts():
+    assert tumor_marker(VALID) == (180.0, 95.0, 140.0)
+    legacy = {"tumor_detection": {"present": True, "coordinates": {"x": "5", "y": 6, "z": 7}}}
+    assert tumor_marker(legacy) == (5.0, 6.0, 7.0)
+    assert tumor_marker({"tumor_detection": {"present": True}}) is None
+    assert tumor_marker({"tumor_detection": "possible glioma"}) is None
+    assert tumor_marker({}) is None
+
+
+def test_analysis_round_trips_through_dict():
+    record = analysis_from_dict(VALID)
+    assert analysis_from_dict(record.to_dict()) == record
@@ -0,0 +1,125 @@
+import threading
+import time
+
+import pytest
+
+from jobs import DONE, QUEUED, RUNNING, JobQueue
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return tmp_path / "jobs.sqlite3"
+
+
+def upload(tmp_path, name="scan"):
+    path = tmp_path / f"{name}.jpg"
+    path.write_bytes(b"scan")
+    return path
+
+
+def wait_for(queue, job_id, status=DONE, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] == status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} still {queue.get(job_id)['status']}")
+
+
+def row(queue, job_id):
+    with queue._db() as db:
+        return db.execute("SELECT status, owner FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+
+def orphan(db_path, tmp_path, status=QUEUED, heartbeat=0.0):
+    """A job left by a process that stopped renewing its lease."""
+    dead = JobQueue(db_path, handler=None)
+    job_id = "orphan"
+    with dead._db() as db:
+        db.execute(
+            "INSERT INTO jobs (id, status, file_path, priority, created_at, owner, heartbeat)"
+            " VALUES (?, ?, ?, 0, ?, ?, ?)",
+            (job_id, status, str(upload(tmp_path)), time.time(), dead.owner, heartbeat),
+        )
+    return job_id
+
+
+def test_job_is_claimed_once_by_queues_sharing_a_db(db_path, tmp_path):
+    calls = []
+    a = JobQueue(db_path, handler=lambda p: calls.append("a") or {"ok": True})
+    b = JobQueue(db_path, handler=lambda p: calls.append("b") or {"ok": True})
+    job_id = orphan(db_path, tmp_path)
+
+    starters = [threading.Thread(target=q.start) for q in (a, b)]
+    for t in starters:
+        t.start()
+    for t in starters:
+        t.join()
+    wait_for(a, job_id)
+    time.sleep(0.1)  # let a second run, if any, happen
+    assert len(calls) == 1
+    assert row(a, job_id)[1] in (a.owner, b.owner)
+
+
+def test_worker_skips_a_job_owned_by_another_queue(db_path, tmp_path):
+    calls = []
+    a = JobQueue(db_path, handler=lambda p: calls.append("a") or {"ok": True}, workers=0)
+    b = JobQueue(db_path, handler=lambda p: calls.append("b") or {"ok": True})
+    job = a.submit(upload(tmp_path))
+
+    b._pending.put((0, 0, job["job_id"]))  # e.g. a stale local queue entry
+    b.start()
+    b._pending.join()
+    assert calls == []
+    assert row(a, job["job_id"]) == (QUEUED, a.owner)
+
+
+@pytest.mark.parametrize("status", [QUEUED, RUNNING])
+def test_stale_jobs_are_taken_over(db_path, tmp_path, status):
+    live = JobQueue(db_path, handler=None)
+    job_id = orphan(db_path, tmp_path, status=status)
+
+    assert live._recover() == 1
+    assert row(live, job_id) == (QUEUED, live.owner)
+    assert live._recover() == 0  # now leased to a live owner
+
+
+def test_jobs_with_a_live_lease_are_left_alone(db_path, tmp_path):
+    live = JobQueue(db_path, handler=None)
+    job_id = orphan(db_path, tmp_path, status=RUNNING, heartbeat=time.time())
+    owner = row(live, job_id)[1]
+
+    assert live._recover() == 0
+    assert row(live, job_id) == (RUNNING, owner)
+
+
+def test_lost_upload_fails_the_taken_over_job(db_path, tmp_path):
+    live = JobQueue(db_path, handler=None)
+    job_id = orphan(db_path, tmp_path)
+    (tmp_path / "scan.jpg").unlink()
+
+    assert live._recover() == 0
+    assert live.get(job_id)["result"] == {"error": "Upload lost before restart"}
+
+
+def test_lower_priority_runs_first_then_fifo(db_path, tmp_path):
+    order, gate = [], threading.Event()
+
+    def handler(path):
+        if path.stem == "first":
+            gate.wait(5)
+        order.append(path.stem)
+        return {"ok": True}
+
+    queue = JobQueue(db_path, handler, workers=1)
+    first = queue.submit(upload(tmp_path, "first"))
+    wait_for(queue, first["job_id"], status=RUNNING)
+    jobs = [
+        queue.submit(upload(tmp_path, name), priority=priority)
+        for name, priority in (("low", 5), ("urgent", 0), ("normal-1", 1), ("normal-2", 1))
+    ]
+    gate.set()
+    for job in jobs:
+        wait_for(queue, job["job_id"])
+    assert order == ["first", "urgent", "normal-1", "normal-2", "low"]
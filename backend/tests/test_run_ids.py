@@ -0,0 +1,86 @@
+import random
+from datetime import datetime
+
+import pytest
+
+from run_ids import (
+    HISTORY_PREFIX, TIMESTAMP_RE, history_key, history_key_timestamp, new_run_id, run_time,
+    search_bound,
+)
+
+OLD = ["20250301_090000", "20250301_120000", "20250302_000001"]
+NEW = [
+    "20250301_115959_999999_0a1b",
+    "20250301_120000_000000_ffff",  # same second as OLD[1]
+    "20250301_120000_000001_0000",
+    "20250301_120000_500000_1234",
+    "20250302_000000_000000_beef",
+]
+
+
+def newest_first(ids):
+    """Run IDs in the order a prefix listing of their history keys returns."""
+    return [history_key_timestamp(k) for k in sorted(history_key(ts) for ts in ids)]
+
+
+def test_new_run_ids_are_valid_and_unique():
+    ids = {new_run_id() for _ in range(1000)}
+    assert len(ids) == 1000
+    assert all(TIMESTAMP_RE.match(ts) for ts in ids)
+
+
+@pytest.mark.parametrize("ts", OLD + NEW)
+def test_history_key_round_trips(ts):
+    key = history_key(ts)
+    assert key.startswith(HISTORY_PREFIX)
+    assert history_key_timestamp(key) == ts
+    assert run_time(ts) == datetime.strptime(ts[:15], "%Y%m%d_%H%M%S")
+
+
+def test_history_keys_list_newest_first_within_one_second():
+    same_second = [f"20250301_120000_{us:06d}_{i:04x}" for i, us in enumerate((0, 1, 9, 10, 999999, 500000))]
+    assert newest_first(same_second) == sorted(same_second, reverse=True)
+
+
+def test_history_keys_list_newest_first_across_formats():
+    ids = OLD + NEW
+    random.Random(4).shuffle(ids)
+    order = newest_first(ids)
+    # Across seconds, both formats interleave by time.
+    assert [ts[:15] for ts in order] == sorted((ts[:15] for ts in ids), reverse=True)
+    # Old IDs have no sub-second part, so within their second they may land
+    # anywhere; the new IDs of that second stay newest-first.
+    same = [ts for ts in order if ts.startswith("20250301_120000_")]
+    assert same == ["20250301_120000_500000_1234", "20250301_120000_000001_0000",
+                    "20250301_120000_000000_ffff"]
+
+
+@pytest.mark.parametrize("value, end, expected", [
+    ("2025-03-01", False, "20250301_000000"),
+    ("2025-03-01", True, "20250301_999999"),
+    ("20250301_120000", False, "20250301_120000"),
+    ("20250301_120000", True, "20250301_120000_999999_ffff"),
+    ("20250301_120000_000001_0000", True, "20250301_120000_000001_0000"),
+])
+def test_search_bound(value, end, expected):
+    assert search_bound(value, end) == expected
+
+
+@pytest.mark.parametrize("start, end, expected", [
+    ("2025-03-01", "2025-03-01", OLD[:2] + NEW[:4]),
+    ("2025-03-02", "2025-03-02", [OLD[2], NEW[4]]),
+    # A second-resolution range covers every run in that second.
+    ("20250301_120000", "20250301_120000",
+     ["20250301_120000", "20250301_120000_000000_ffff", "20250301_120000_000001_0000",
+      "20250301_120000_500000_1234"]),
+    ("20250301_120000_000001_0000", "2025-03-01",
+     ["20250301_120000_000001_0000", "20250301_120000_500000_1234"]),
+])
+def test_search_bounds_select_runs_of_both_formats(start, end, expected):
+    low, high = search_bound(start), search_bound(end, end=True)
+    assert sorted(ts for ts in OLD + NEW if low <= ts <= high) == sorted(expected)
+
+
+def test_search_bound_rejects_other_formats():
+    with pytest.raises(ValueError):
+        search_bound("03/01/2025")
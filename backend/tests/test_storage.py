@@ -0,0 +1,78 @@
+import random
+
+import pytest
+
+from storage import LocalStorage
+
+# Names around "/" in sort order ("-" and "." before it, "0" after) are where
+# a directory walk and S3's plain key order can disagree.
+KEYS = sorted([
+    "index/history/99999_a.json", "index/history/99999_b.json", "index/history/0001_z.json",
+    "index/hash/ab.json", "index/hist.json",
+    "saved/20250301_120000/context.json", "saved/20250301_120000/mri.jpg",
+    "saved/20250301_120000-b/mri.jpg", "saved/20250301_120000.json", "saved/20250301_1200000/x",
+    "saved/20250301_120001/a/b/c.txt", "saved/20250301_120001/a-b", "saved/20250301_120001/a.b",
+    "saved/20250301_120001/a0",
+    "x", "x-", "x.y", "x0/y", "y/z",
+])
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    store = LocalStorage(tmp_path_factory.mktemp("store"), "http://localhost:5000")
+    for key in KEYS:
+        store.put(key, key, "text/plain")
+    (store.root / "saved" / ".mri.jpg.123.tmp").write_bytes(b"partial")  # in-progress put
+    return store
+
+
+def reference(prefix, start_after=None):
+    return [k for k in KEYS if k.startswith(prefix) and (start_after is None or k > start_after)]
+
+
+def keys(objs):
+    return [o["Key"] for o in objs]
+
+
+PREFIXES = ["", "index/", "index/hist", "index/history/", "saved/", "saved/20250301_1200",
+            "saved/20250301_120001/a", "x", "missing/", "nothing"]
+
+
+@pytest.mark.parametrize("prefix", PREFIXES)
+def test_list_matches_sorted_keys(store, prefix):
+    objs, truncated = store.list(prefix)
+    assert keys(objs) == reference(prefix) and not truncated
+    assert list(store.iter_keys(prefix)) == reference(prefix)
+
+
+@pytest.mark.parametrize("prefix", PREFIXES)
+def test_list_start_after_matches_reference(store, prefix):
+    # Existing keys, and keys between them that name no object.
+    starts = KEYS + [k[:-1] for k in KEYS] + [k + "/" for k in KEYS] + ["", "a", "saved/", "zzz"]
+    for start_after in starts:
+        objs, _ = store.list(prefix, start_after=start_after or None)
+        assert keys(objs) == reference(prefix, start_after or None), start_after
+
+
+@pytest.mark.parametrize("max_keys", [1, 2, 3, 7, 100])
+def test_pages_cover_every_key_once(store, max_keys):
+    seen, start_after, truncated = [], None, True
+    while truncated:
+        objs, truncated = store.list("", start_after=start_after, max_keys=max_keys)
+        assert len(objs) <= max_keys
+        seen += keys(objs)
+        start_after = seen[-1] if seen else None
+    assert seen == KEYS
+
+
+def test_random_prefixes_and_pages(store):
+    rng = random.Random(0)
+    for _ in range(300):
+        key = rng.choice(KEYS)
+        prefix = key[:rng.randrange(len(key) + 1)]
+        start_after = rng.choice([None, rng.choice(KEYS)[:rng.randrange(1, 30)]])
+        max_keys = rng.randrange(1, 6)
+        objs, truncated = store.list(prefix, start_after=start_after, max_keys=max_keys)
+        expected = reference(prefix, start_after)
+        assert keys(objs) == expected[:max_keys]
+        assert truncated == (len(expected) > max_keys)
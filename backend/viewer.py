@@ -1,126 +1,547 @@
 import pydicom
 import numpy as np
+import hashlib
+import json
 import os
+import time
 # import re # No longer needed if only using InstanceNumber
 from pathlib import Path
-import napari
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import argparse
 
 # --- Configuration ---
 # (No specific config needed for InstanceNumber sorting)
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+# Assembled volumes are cached here as <key>.npy + <key>.json and memory-mapped
+# on later launches. The key covers file names, sizes and mtimes.
+DEFAULT_CACHE_DIR = Path(os.environ.get("VIEWER_CACHE_DIR", Path(__file__).parent / ".volume_cache"))
+CACHE_VERSION = 1
+# Multiscale mode halves every axis per level until the smallest axis would
+# drop below PYRAMID_MIN_SIZE. Contrast limits come from a strided sample.
+PYRAMID_MAX_LEVELS = 5
+PYRAMID_MIN_SIZE = 32
+CONTRAST_SAMPLES = 1_000_000
+CONTRAST_PERCENTILES = (0.5, 99.5)
 # --- End Configuration ---
 
-def load_scan_using_instance_number(directory_path_str):
+def _read_slice(filepath):
+    """
+    Reads one DICOM file in a single full pass and returns
+    (InstanceNumber, filename, pixel_array), or (None, filename, message)
+    when the file has to be skipped. Top-level so process pools can pickle it.
+    """
+    try:
+        ds = pydicom.dcmread(filepath, force=True)
+    except pydicom.errors.InvalidDicomError:
+        return None, filepath.name, None # Ignore non-DICOMs quietly
+    except Exception as e:
+        return None, filepath.name, f"Could not read {filepath.name}: {e}. Skipping."
+
+    instance_num = ds.get("InstanceNumber")
+    if instance_num is None:
+        return None, filepath.name, f"DICOM tag 'InstanceNumber' not found in {filepath.name}. Skipping."
+    try:
+        instance_num = int(instance_num)
+    except ValueError:
+        return None, filepath.name, f"InstanceNumber '{instance_num}' in {filepath.name} is not a valid integer. Skipping."
+
+    try:
+        return instance_num, filepath.name, ds.pixel_array
+    except AttributeError:
+        return None, filepath.name, f"File {filepath.name} has header but lacks pixel data. Skipping slice."
+    except Exception as e:
+        return None, filepath.name, f"Could not read pixel data for {filepath.name}: {e}. Skipping slice."
+
+
+def _permute_slices_inplace(volume, order):
+    """
+    Reorders volume so that volume[i] becomes the old volume[order[i]],
+    following permutation cycles with a single slice of scratch memory.
+    """
+    done = np.zeros(len(order), dtype=bool)
+    for start in range(len(order)):
+        if done[start]:
+            continue
+        if order[start] == start:
+            done[start] = True
+            continue
+        scratch = volume[start].copy()
+        i = start
+        while True:
+            done[i] = True
+            j = order[i]
+            if j == start:
+                volume[i] = scratch
+                break
+            volume[i] = volume[j]
+            i = j
+
+
+def _series_files(dicom_path):
+    return [
+        p for p in dicom_path.glob('*')
+        if p.is_file() and p.suffix.lower() in ['.dcm', '.dicom']
+    ]
+
+
+def _cache_key(files):
+    h = hashlib.sha1(f"v{CACHE_VERSION}".encode())
+    for p in sorted(files, key=lambda p: p.name):
+        st = p.stat()
+        h.update(f"{p.name}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+def _load_cached_volume(cache_dir, key):
+    meta_path = cache_dir / f"{key}.json"
+    if not meta_path.exists(): # the sidecar is written last, so it marks a complete entry
+        return None, None
+    try:
+        meta = json.loads(meta_path.read_text())
+        volume = np.load(cache_dir / f"{key}.npy", mmap_mode='r')
+    except (OSError, ValueError) as e:
+        print(f"  Warning: ignoring unreadable volume cache {key}: {e}")
+        return None, None
+    return volume, meta["filenames"]
+
+
+def _save_cached_volume(cache_dir, key, volume, filenames, source):
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = cache_dir / f".{key}.{os.getpid()}.npy"
+        np.save(tmp, volume)
+        os.replace(tmp, cache_dir / f"{key}.npy")
+        (cache_dir / f"{key}.json").write_text(json.dumps({
+            "source": str(source),
+            "shape": list(volume.shape),
+            "dtype": str(volume.dtype),
+            "filenames": filenames,
+        }))
+    except OSError as e:
+        print(f"  Warning: could not write volume cache: {e}")
+
+
+def load_scan_using_instance_number(directory_path_str, workers=DEFAULT_WORKERS,
+                                    use_processes=False, verbose=False,
+                                    cache_dir=DEFAULT_CACHE_DIR):
     """
     Loads DICOM files from a directory, sorts them based on the
     'InstanceNumber' (0020, 0013) DICOM tag, and stacks them
-    into a 3D numpy array. (Identical to previous version)
+    into a 3D numpy array.
+
+    Each file is read once (header and pixels together) on a pool of
+    `workers` threads, or processes when `use_processes` is set (better for
+    compressed transfer syntaxes whose decoders hold the GIL). Slices are
+    copied into one preallocated array as they finish decoding and put in
+    InstanceNumber order in place, so peak memory stays near one volume.
+    Per-slice output is only printed when `verbose` is set.
+
+    With a `cache_dir`, the assembled volume is saved there and later calls
+    on an unchanged directory return a read-only memory map of it instead.
     """
     dicom_path = Path(directory_path_str)
     if not dicom_path.is_dir():
         print(f"Error: Directory not found: {directory_path_str}")
         return None, None
 
-    slices_info = []
-    print(f"\n--- Scanning directory for DICOM headers: {dicom_path} ---")
-    print("--- Reading 'InstanceNumber' tag for sorting ---")
+    t_start = time.perf_counter()
+    files_to_process = _series_files(dicom_path)
+
+    key = None
+    if cache_dir is not None and files_to_process:
+        cache_dir = Path(cache_dir)
+        key = _cache_key(files_to_process)
+        volume, filenames = _load_cached_volume(cache_dir, key)
+        if volume is not None:
+            print(f"Memory-mapped cached volume {volume.shape} for {dicom_path} "
+                  f"in {time.perf_counter() - t_start:.3f}s")
+            return volume, filenames
 
-    files_to_process = list(dicom_path.glob('*'))
-    print(f"Found {len(files_to_process)} items. Filtering DICOMs and reading InstanceNumber...")
+    print(f"Found {len(files_to_process)} DICOM files in {dicom_path}. "
+          f"Reading with {workers} {'processes' if use_processes else 'threads'}...")
 
-    processed_count = 0
+    # Read headers + pixel data in one pass per file, filling slots in
+    # completion order; `placed` remembers which slot holds which slice.
+    volume = None
+    placed = [] # (InstanceNumber, directory index, filename)
     skipped_count = 0
-    # First pass: Read headers and InstanceNumber
-    for filepath in files_to_process:
-        if filepath.is_file() and filepath.suffix.lower() in ['.dcm', '.dicom']:
-            try:
-                ds = pydicom.dcmread(filepath, stop_before_pixels=True, force=True)
-                instance_num = ds.get("InstanceNumber")
-                if instance_num is not None:
-                    try:
-                        slices_info.append({'path': filepath, 'InstanceNumber': int(instance_num)})
-                        processed_count += 1
-                    except ValueError:
-                         print(f"  Warning: InstanceNumber '{instance_num}' in {filepath.name} is not a valid integer. Skipping.")
-                         skipped_count += 1
-                else:
-                    print(f"  Warning: DICOM tag 'InstanceNumber' not found in {filepath.name}. Skipping.")
+    pool_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with pool_cls(max_workers=max(1, workers)) as pool:
+        pending = {pool.submit(_read_slice, p): idx for idx, p in enumerate(files_to_process)}
+        for future in as_completed(pending):
+            idx = pending.pop(future)
+            instance_num, name, payload = future.result()
+            del future # drop the decoded array once it is copied
+            if instance_num is None:
+                if payload is not None:
+                    print(f"  Warning: {payload}")
                     skipped_count += 1
-            except pydicom.errors.InvalidDicomError:
-                pass # Ignore non-DICOMs quietly
-            except Exception as e:
-                print(f"  Warning: Could not read header/tag from {filepath.name}: {e}. Skipping.")
-                skipped_count += 1
+                continue
 
-    print(f"\nFinished scanning headers: Found {processed_count} files with InstanceNumber, skipped {skipped_count}.")
+            if volume is None:
+                volume = np.empty((len(files_to_process),) + payload.shape, dtype=payload.dtype)
+            elif payload.shape != volume.shape[1:]:
+                first_name = min(placed, key=lambda s: s[1])[2] if placed else "?"
+                print(f"\nError: Slice dimensions mismatch!")
+                print(f"  Slice {first_name} shape: {volume.shape[1:]}")
+                print(f"  Slice {name} shape: {payload.shape}")
+                print("Cannot stack slices of different sizes. Volume creation failed.")
+                for f in pending:
+                    f.cancel()
+                return None, None
+            elif not np.can_cast(payload.dtype, volume.dtype, casting='safe'):
+                volume = volume.astype(np.result_type(volume.dtype, payload.dtype))
 
-    if not slices_info:
-        print(f"\nError: No DICOM files with a valid 'InstanceNumber' tag found in {dicom_path}.")
+            volume[len(placed)] = payload
+            placed.append((instance_num, idx, name))
+    t_read = time.perf_counter()
+
+    print(f"Read {len(placed)} slices, skipped {skipped_count}.")
+
+    if not placed:
+        print(f"\nError: No DICOM files with a valid 'InstanceNumber' tag and pixel data found in {dicom_path}.")
         return None, None
 
-    # Sort by InstanceNumber
-    print("\n--- Sorting slices by InstanceNumber ---")
+    # Sort by InstanceNumber (ties keep directory order) and reorder in place
+    order = sorted(range(len(placed)), key=lambda slot: placed[slot][:2])
+    scan_volume = volume[:len(placed)]
+    _permute_slices_inplace(scan_volume, order)
+    loaded_filenames_in_order = [placed[slot][2] for slot in order]
+    if verbose:
+        print("--- Final Sorted Order (based on InstanceNumber) ---")
+        for i, slot in enumerate(order):
+            print(f"  {i+1:04d}: {placed[slot][2]} (InstanceNumber: {placed[slot][0]})")
+        print("--- End Sorted Order ---")
+    t_done = time.perf_counter()
+
+    print(f"Volume shape (slices(z), height(y), width(x)): {scan_volume.shape}")
+    print(f"Timing: read+decode {t_read - t_start:.2f}s, sort {t_done - t_read:.2f}s, "
+          f"total {t_done - t_start:.2f}s")
+
+    if key is not None:
+        _save_cached_volume(cache_dir, key, scan_volume, loaded_filenames_in_order, dicom_path)
+    # Return the filenames corresponding to the successfully loaded and stacked slices
+    return scan_volume, loaded_filenames_in_order
+
+
+def _read_instance_number(filepath):
     try:
-        slices_info.sort(key=lambda s: s['InstanceNumber'])
-    except Exception as e:
-        print(f"Error during sorting by InstanceNumber: {e}")
+        ds = pydicom.dcmread(filepath, stop_before_pixels=True, force=True)
+        return int(ds.InstanceNumber), filepath
+    except Exception:
+        return None, filepath
+
+
+def _read_pixels(filepath):
+    return pydicom.dcmread(filepath, force=True).pixel_array
+
+
+def lazy_scan_volume(directory_path_str, workers=DEFAULT_WORKERS):
+    """
+    Builds a dask array over the series with one chunk per slice. Only the
+    headers are read up front (to sort by InstanceNumber); pixel data is
+    decoded when napari first asks for a slice. Requires dask.
+    """
+    import dask
+    import dask.array as da
+
+    dicom_path = Path(directory_path_str)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        headers = [h for h in pool.map(_read_instance_number, _series_files(dicom_path)) if h[0] is not None]
+    if not headers:
+        print(f"\nError: No DICOM files with a valid 'InstanceNumber' tag found in {dicom_path}.")
         return None, None
+    headers.sort(key=lambda h: h[0])
 
-    print("--- Final Sorted Order (based on InstanceNumber) ---")
-    # Keep track of filenames in sorted order
-    sorted_filenames = [s_info['path'].name for s_info in slices_info]
-    for i, s_info in enumerate(slices_info):
-        inst_num = s_info.get('InstanceNumber', 'N/A')
-        print(f"  {i+1:04d}: {s_info['path'].name} (InstanceNumber: {inst_num})")
-    print("--- End Sorted Order ---")
+    first = _read_pixels(headers[0][1]) # shape and dtype for the lazy chunks
+    slices = [
+        da.from_delayed(dask.delayed(_read_pixels)(path), shape=first.shape, dtype=first.dtype)
+        for _, path in headers
+    ]
+    volume = da.stack(slices)
+    print(f"Lazy volume over {len(headers)} slices, shape {volume.shape}")
+    return volume, [path.name for _, path in headers]
 
 
-    # Second pass: Read pixel data for sorted files
-    print("\n--- Reading pixel data for sorted slices ---")
-    slices = []
-    loaded_filenames_in_order = [] # Store filenames corresponding to loaded slices
-    load_errors = 0
-    pixel_data_skipped = 0
+def _downsample2(level):
+    """2x2x2 mean of `level`, computed a few output slices at a time."""
+    nz, ny, nx = (max(1, n // 2) for n in level.shape)
+    out = np.empty((nz, ny, nx), dtype=level.dtype)
+    step = 8
+    for z in range(0, nz, step):
+        zs = min(step, nz - z)
+        block = np.asarray(level[2 * z:2 * (z + zs), :2 * ny, :2 * nx], dtype=np.float32)
+        block = block.reshape(zs, 2, ny, 2, nx, 2).mean(axis=(1, 3, 5))
+        if np.issubdtype(out.dtype, np.integer):
+            block = np.rint(block)
+        out[z:z + zs] = block
+    return out
 
-    for i, slice_info in enumerate(slices_info):
-        try:
-            ds = pydicom.dcmread(slice_info['path'])
-            pixel_array = ds.pixel_array
-            slices.append(pixel_array)
-            loaded_filenames_in_order.append(slice_info['path'].name) # Keep track
-        except AttributeError:
-             print(f"Warning: File {slice_info['path'].name} has header but lacks pixel data (AttributeError). Skipping slice.")
-             pixel_data_skipped += 1
-        except Exception as e:
-            print(f"Warning: Could not read pixel data for {slice_info['path'].name}: {e}. Skipping slice.")
-            load_errors += 1
-
-    if not slices:
-        print("\nError: Failed to load pixel data from any DICOM files after sorting.")
-        return None, None # Return None for filenames too if no volume
-    if load_errors > 0 or pixel_data_skipped > 0:
-         print(f"\nWarning: Encountered errors or missing pixel data for {load_errors + pixel_data_skipped} files.")
-
-    print(f"\nSuccessfully loaded pixel data for {len(slices)} slices. Stacking into 3D volume...")
-
-    # Stacking and shape check
+
+def build_pyramid(volume, cache_dir=None, key=None):
+    """
+    Returns [volume, volume/2, volume/4, ...] for napari's multiscale mode.
+    With a cache_dir and key, levels are stored next to the cached volume as
+    <key>.L<n>.npy and memory-mapped on later calls.
+    """
+    levels = [volume]
+    while len(levels) < PYRAMID_MAX_LEVELS and min(levels[-1].shape) // 2 >= PYRAMID_MIN_SIZE:
+        n = len(levels)
+        path = Path(cache_dir) / f"{key}.L{n}.npy" if cache_dir is not None and key else None
+        if path is not None and path.exists():
+            levels.append(np.load(path, mmap_mode='r'))
+            continue
+        level = _downsample2(levels[-1])
+        if path is not None:
+            try:
+                tmp = path.with_name(f".{path.name}.{os.getpid()}")
+                with open(tmp, 'wb') as f:
+                    np.save(f, level)
+                os.replace(tmp, path)
+            except OSError as e:
+                print(f"  Warning: could not cache pyramid level {n}: {e}")
+        levels.append(level)
+    print("Pyramid levels: " + ", ".join(str(tuple(l.shape)) for l in levels))
+    return levels
+
+
+def sampled_contrast_limits(volume, percentiles=CONTRAST_PERCENTILES, max_samples=CONTRAST_SAMPLES):
+    """
+    Estimates display limits from about `max_samples` voxels taken on a
+    regular stride, so only a fraction of a memory-mapped or lazy volume is
+    read. Falls back to the sample's min/max for flat images.
+    """
+    stride = max(1, int(round((np.prod(volume.shape) / max_samples) ** (1 / 3))))
+    sample = np.asarray(volume[::stride, ::stride, ::stride], dtype=np.float32).ravel()
+    lo, hi = np.percentile(sample, percentiles)
+    if hi <= lo:
+        lo, hi = float(sample.min()), float(sample.max())
+    if hi <= lo:
+        hi = lo + 1
+    return [float(lo), float(hi)]
+
+
+def window_to_uint8(plane, clim):
+    """Maps [lo, hi] contrast limits onto 0..255 for 8-bit image export."""
+    lo, hi = clim
+    scaled = (np.asarray(plane, dtype=np.float32) - lo) * (255.0 / (hi - lo))
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+
+# --- Display ---
+MARKER_LAYERS = ('Center Marker', 'Z-Axis', 'Y-Axis', 'X-Axis')
+
+
+def add_marker_layers(viewer, shape, tumor_coords, sphere_size, sphere_color):
+    """
+    (Re)draws the center marker and axes, replacing any drawn earlier, so an
+    open window can be pointed at new tumor coordinates.
+    """
+    for name in MARKER_LAYERS:
+        if name in viewer.layers:
+            viewer.layers.remove(name)
+
+    # Calculate the center point - use tumor coordinates if provided, otherwise use volume center
+    if tumor_coords:
+        x_center, y_center, z_center = tumor_coords
+        print(f"Using tumor coordinates as center point: [{z_center:.1f}, {y_center:.1f}, {x_center:.1f}]")
+    else:
+        z_center, y_center, x_center = np.array(shape) / 2
+        print(f"Using volume center as center point: [{z_center:.1f}, {y_center:.1f}, {x_center:.1f}]")
+    
+    # Create a points layer for the center marker
+    points = np.array([[z_center, y_center, x_center]])  # Single point at center
+    
+    # Add the center marker as a points layer
+    # Using 'disc' instead of 'sphere' (which wasn't valid)
+    viewer.add_points(
+        points,
+        name='Center Marker',
+        size=sphere_size,
+        face_color=sphere_color,
+        n_dimensional=True,
+        opacity=0.8,
+        symbol='disc'  # Changed from 'sphere' to 'disc' which is valid in napari
+    )
+    
+    print(f"Added a {sphere_color} marker (size: {sphere_size}) at center: [{z_center:.1f}, {y_center:.1f}, {x_center:.1f}]")
+
+    # Optional: Add a 3D scale bar
+    # We can use the Shape layer to create a cross or axes at the center
+    # Create cross-hairs at center
+    if sphere_size > 0:
+        # Size of cross-hairs (make relative to sphere size)
+        axis_length = sphere_size * 2
+        
+        # Create three lines for x, y, z axes
+        z_axis = np.array([[z_center-axis_length, y_center, x_center], 
+                           [z_center+axis_length, y_center, x_center]])
+        y_axis = np.array([[z_center, y_center-axis_length, x_center], 
+                           [z_center, y_center+axis_length, x_center]])
+        x_axis = np.array([[z_center, y_center, x_center-axis_length], 
+                           [z_center, y_center, x_center+axis_length]])
+        
+        # Add each axis as a shape with different colors
+        viewer.add_shapes(
+            z_axis, 
+            shape_type='line', 
+            edge_color='blue', 
+            edge_width=2,
+            name='Z-Axis'
+        )
+        viewer.add_shapes(
+            y_axis, 
+            shape_type='line', 
+            edge_color='green', 
+            edge_width=2,
+            name='Y-Axis'
+        )
+        viewer.add_shapes(
+            x_axis, 
+            shape_type='line', 
+            edge_color='red', 
+            edge_width=2,
+            name='X-Axis'
+        )
+        
+        print("Added coordinate axes at center (red=X, green=Y, blue=Z)")
+
+
+def prepare_scan(dicom_dir, args):
+    """
+    Loads `dicom_dir` according to the command-line options in `args`.
+    Returns (volume, image layer data, contrast limits), or None if the
+    scan could not be loaded.
+    """
+    print(f"Attempting to load scan from: {dicom_dir}")
+    print(f"Sorting by: DICOM InstanceNumber (0020, 0013)")
+
+    cache_dir = None if args.no_cache else Path(args.cache_dir)
+    if args.lazy:
+        scan_volume, filenames = lazy_scan_volume(dicom_dir, workers=args.workers)
+    else:
+        scan_volume, filenames = load_scan_using_instance_number(
+            dicom_dir, workers=args.workers, use_processes=args.processes, verbose=args.verbose,
+            cache_dir=cache_dir
+        )
+    if scan_volume is None:
+        return None
+
+    clim = sampled_contrast_limits(scan_volume)
+    image_data = scan_volume
+    if args.multiscale:
+        key = None
+        if cache_dir is not None and not args.lazy:
+            key = _cache_key(_series_files(Path(dicom_dir)))
+        image_data = build_pyramid(scan_volume, cache_dir, key)
+    return scan_volume, image_data, clim
+
+
+def show_scan(viewer, prepared, args, tumor_coords=None):
+    """Adds a scan returned by prepare_scan, plus the marker layers, to `viewer`."""
+    scan_volume, image_data, clim = prepared
+    render_mode = args.render
+
+    print(f"\nLaunching napari viewer in 3D ({render_mode} rendering)...")
+    print(" - Use mouse drag to rotate the volume.")
+    print(" - Use scroll wheel or right-mouse-drag to zoom.")
+    print(" - Adjust contrast/brightness/colormap/rendering via controls on left.")
+    if render_mode == 'iso':
+        print(" - NOTE: For 'iso' rendering, you MUST adjust the 'iso_threshold' slider in the layer controls.")
+
+    # Set viewer to 3D display mode *before* adding the image
+    viewer.dims.ndisplay = 3
+
+    print(f"Setting initial contrast limits to: [{clim[0]:.2f}, {clim[1]:.2f}]")
+
+    # Add the 3D volume as an image layer with specified rendering
+    viewer.add_image(
+        image_data,
+        multiscale=args.multiscale,
+        name='CT Scan 3D',
+        colormap='gray', # Common starting point for CT
+        contrast_limits=list(clim),
+        rendering=render_mode, # Use the chosen rendering mode
+        blending='additive' if render_mode == 'additive' else 'translucent' # Blending often works well with translucent/additive
+        # iso_threshold=XXX # Only needed if rendering='iso', better set interactively
+    )
+
+    add_marker_layers(viewer, scan_volume.shape, tumor_coords, args.sphere_size, args.sphere_color)
+
+
+# --- Worker Mode ---
+def run_worker(address, args):
+    """
+    Pooled viewer process: napari and Qt are imported once up front, then
+    commands arrive over a multiprocessing connection to `address`:
+
+        {"cmd": "open", "scan_dir": ..., "tumor_coords": [x, y, z] | None}
+        {"cmd": "quit"}
+
+    Opening the scan that is already shown only redraws the marker and
+    raises the window. Replies are events: ready, opened, error, closed.
+    """
+    from multiprocessing.connection import Client
+    import napari
+    from qtpy.QtCore import QTimer
     try:
-        first_shape = slices[0].shape
-        for idx, s in enumerate(slices):
-            if s.shape != first_shape:
-                print(f"\nError: Slice dimensions mismatch!")
-                print(f"  Slice 0 ({loaded_filenames_in_order[0]}) shape: {first_shape}")
-                print(f"  Slice {idx} ({loaded_filenames_in_order[idx]}) shape: {s.shape}")
-                print("Cannot stack slices of different sizes. Volume creation failed.")
-                return None, None # Return None for filenames too
+        from napari.qt import get_qapp
+    except ImportError: # napari < 0.5
+        from napari.qt import get_app as get_qapp
 
-        scan_volume = np.stack(slices, axis=0)
-        print(f"Volume shape (slices(z), height(y), width(x)): {scan_volume.shape}")
-        # Return the filenames corresponding to the successfully loaded and stacked slices
-        return scan_volume, loaded_filenames_in_order
-    except Exception as e:
-        print(f"An unexpected error occurred during stacking: {e}")
-        return None, None
+    qapp = get_qapp()
+    qapp.setQuitOnLastWindowClosed(False) # stay warm after the user closes the window
+    conn = Client(address, authkey=bytes.fromhex(os.environ["VIEWER_AUTHKEY"]))
+    conn.send({"event": "ready", "pid": os.getpid()})
+    state = {"viewer": None, "scan_dir": None, "shape": None, "seq": None}
+
+    def close_viewer():
+        if state["viewer"] is not None:
+            state["viewer"].close()
+        state["viewer"] = state["scan_dir"] = state["shape"] = None
+
+    def handle_open(msg):
+        scan_dir, tumor_coords, seq = msg["scan_dir"], msg.get("tumor_coords"), msg.get("seq")
+        viewer = state["viewer"]
+        if viewer is not None and state["scan_dir"] == scan_dir:
+            add_marker_layers(viewer, state["shape"], tumor_coords, args.sphere_size, args.sphere_color)
+            viewer.window._qt_window.raise_()
+            viewer.window._qt_window.activateWindow()
+            state["seq"] = seq
+            conn.send({"event": "opened", "scan_dir": scan_dir, "seq": seq, "reused": True})
+            return
+        close_viewer()
+        prepared = prepare_scan(scan_dir, args)
+        if prepared is None:
+            conn.send({"event": "error", "scan_dir": scan_dir, "seq": seq, "error": "Could not load scan"})
+            return
+        viewer = napari.Viewer(title=f"MRI - {Path(scan_dir).name}")
+        show_scan(viewer, prepared, args, tumor_coords)
+        state.update(viewer=viewer, scan_dir=scan_dir, shape=prepared[0].shape, seq=seq)
+        conn.send({"event": "opened", "scan_dir": scan_dir, "seq": seq, "reused": False})
+
+    def poll():
+        try:
+            if state["viewer"] is not None and not state["viewer"].window._qt_window.isVisible():
+                scan_dir, seq = state["scan_dir"], state["seq"]
+                close_viewer()
+                conn.send({"event": "closed", "scan_dir": scan_dir, "seq": seq})
+            while conn.poll():
+                msg = conn.recv()
+                if msg["cmd"] == "quit":
+                    qapp.quit()
+                    return
+                if msg["cmd"] == "open":
+                    handle_open(msg)
+        except (EOFError, OSError): # the server went away
+            qapp.quit()
+
+    timer = QTimer()
+    timer.timeout.connect(poll)
+    timer.start(100)
+    print(f"Viewer worker {os.getpid()} ready")
+    qapp.exec_()
+    close_viewer()
 
 
 # --- Main Execution ---
@@ -132,6 +553,7 @@ if __name__ == "__main__":
     parser.add_argument(
         'dicom_directory',
         type=str,
+        nargs='?',
         help='Path to the directory containing the DICOM files.'
     )
     parser.add_argument(
@@ -163,113 +585,66 @@ if __name__ == "__main__":
         help="Tumor coordinates (x, y, z) to use as center point"
     )
 
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Number of parallel readers used to load the series."
+    )
+    parser.add_argument(
+        '--processes',
+        action='store_true',
+        help="Read with a process pool instead of threads (helps with compressed DICOMs)."
+    )
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        default=str(DEFAULT_CACHE_DIR),
+        help="Directory for the memory-mapped volume cache."
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help="Always decode the series and do not write the volume cache."
+    )
+    parser.add_argument(
+        '--multiscale',
+        action='store_true',
+        help="Display a cached multiscale pyramid (coarse levels render first)."
+    )
+    parser.add_argument(
+        '--lazy',
+        action='store_true',
+        help="Decode slices on demand through dask instead of loading the whole series."
+    )
+    parser.add_argument(
+        '--worker',
+        type=str,
+        metavar='ADDRESS',
+        help="Run as a pooled viewer: connect to ADDRESS (authkey in VIEWER_AUTHKEY) "
+             "and open scans on request instead of loading dicom_directory."
+    )
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        help="Print the per-slice sorted order while loading."
+    )
+
     args = parser.parse_args()
-    dicom_dir = args.dicom_directory
-    render_mode = args.render
-    sphere_size = args.sphere_size
-    sphere_color = args.sphere_color
-    tumor_coords = args.tumor_coords
 
-    print(f"Attempting to load scan from: {dicom_dir}")
-    print(f"Sorting by: DICOM InstanceNumber (0020, 0013)")
+    if args.worker:
+        run_worker(args.worker, args)
+    elif not args.dicom_directory:
+        parser.error("dicom_directory is required unless --worker is given")
+    else:
+        prepared = prepare_scan(args.dicom_directory, args)
+        if prepared is not None:
+            import napari # imported here so loader-only users skip Qt
 
-    scan_volume, filenames = load_scan_using_instance_number(dicom_dir)
-
-    if scan_volume is not None:
-        print(f"\nLaunching napari viewer in 3D ({render_mode} rendering)...")
-        print(" - Use mouse drag to rotate the volume.")
-        print(" - Use scroll wheel or right-mouse-drag to zoom.")
-        print(" - Adjust contrast/brightness/colormap/rendering via controls on left.")
-        if render_mode == 'iso':
-            print(" - NOTE: For 'iso' rendering, you MUST adjust the 'iso_threshold' slider in the layer controls.")
-
-        viewer = napari.Viewer()
-
-        # Set viewer to 3D display mode *before* adding the image
-        viewer.dims.ndisplay = 3
-        clim = [np.min(scan_volume), np.max(scan_volume)]
-
-        print(f"Setting initial contrast limits to: [{clim[0]:.2f}, {clim[1]:.2f}]")
-
-        # Add the 3D volume as an image layer with specified rendering
-        viewer.add_image(
-            scan_volume,
-            name='CT Scan 3D',
-            colormap='gray', # Common starting point for CT
-            contrast_limits=list(clim),
-            rendering=render_mode, # Use the chosen rendering mode
-            blending='additive' if render_mode == 'additive' else 'translucent' # Blending often works well with translucent/additive
-            # iso_threshold=XXX # Only needed if rendering='iso', better set interactively
-        )
+            viewer = napari.Viewer()
+            show_scan(viewer, prepared, args, args.tumor_coords)
+            napari.run() # Start the napari GUI event loop
 
-        # Calculate the center point - use tumor coordinates if provided, otherwise use volume center
-        if tumor_coords:
-            x_center, y_center, z_center = tumor_coords
-            print(f"Using tumor coordinates as center point: [{z_center:.1f}, {y_center:.1f}, {x_center:.1f}]")
+            print("Napari viewer closed.")
         else:
-            z_center, y_center, x_center = np.array(scan_volume.shape) / 2
-            print(f"Using volume center as center point: [{z_center:.1f}, {y_center:.1f}, {x_center:.1f}]")
-        
-        # Create a points layer for the center marker
-        points = np.array([[z_center, y_center, x_center]])  # Single point at center
-        
-        # Add the center marker as a points layer
-        # Using 'disc' instead of 'sphere' (which wasn't valid)
-        viewer.add_points(
-            points,
-            name='Center Marker',
-            size=sphere_size,
-            face_color=sphere_color,
-            n_dimensional=True,
-            opacity=0.8,
-            symbol='disc'  # Changed from 'sphere' to 'disc' which is valid in napari
-        )
-        
-        print(f"Added a {sphere_color} marker (size: {sphere_size}) at center: [{z_center:.1f}, {y_center:.1f}, {x_center:.1f}]")
-
-        # Optional: Add a 3D scale bar
-        # We can use the Shape layer to create a cross or axes at the center
-        # Create cross-hairs at center
-        if sphere_size > 0:
-            # Size of cross-hairs (make relative to sphere size)
-            axis_length = sphere_size * 2
-            
-            # Create three lines for x, y, z axes
-            z_axis = np.array([[z_center-axis_length, y_center, x_center], 
-                               [z_center+axis_length, y_center, x_center]])
-            y_axis = np.array([[z_center, y_center-axis_length, x_center], 
-                               [z_center, y_center+axis_length, x_center]])
-            x_axis = np.array([[z_center, y_center, x_center-axis_length], 
-                               [z_center, y_center, x_center+axis_length]])
-            
-            # Add each axis as a shape with different colors
-            viewer.add_shapes(
-                z_axis, 
-                shape_type='line', 
-                edge_color='blue', 
-                edge_width=2,
-                name='Z-Axis'
-            )
-            viewer.add_shapes(
-                y_axis, 
-                shape_type='line', 
-                edge_color='green', 
-                edge_width=2,
-                name='Y-Axis'
-            )
-            viewer.add_shapes(
-                x_axis, 
-                shape_type='line', 
-                edge_color='red', 
-                edge_width=2,
-                name='X-Axis'
-            )
-            
-            print("Added coordinate axes at center (red=X, green=Y, blue=Z)")
-
-        napari.run() # Start the napari GUI event loop
-
-        print("Napari viewer closed.")
-
-    else:
-        print(f"\nExiting due to errors loading/processing the scan from '{dicom_dir}'. Check warnings above.")
\ No newline at end of file
+            print(f"\nExiting due to errors loading/processing the scan from '{args.dicom_directory}'. Check warnings above.")
@@ -0,0 +1,146 @@
+"""Warm pool of napari viewer processes for /run-viewer.
+
+Each worker is ``viewer.py --worker``: it imports napari and Qt once, then
+waits for commands on a local ``multiprocessing.connection`` channel. The
+pool keeps ``warm`` idle workers ready, allows at most ``max_open`` windows
+at a time, and re-targets the window already showing a scan directory
+instead of opening a second one.
+"""
+
+import os
+import secrets
+import subprocess
+import sys
+import threading
+from multiprocessing.connection import Listener
+from pathlib import Path
+
+VIEWER_SCRIPT = Path(__file__).parent / "viewer.py"
+
+
+class ViewerLimit(RuntimeError):
+    pass
+
+
+class _Worker:
+    def __init__(self, proc):
+        self.proc = proc
+        self.conn = None
+        self.ready = threading.Event()  # set once the worker has connected
+        self.scan_dir = None  # what its window shows (or is about to)
+        self.seq = 0  # last open command sent; stale "closed" events are ignored
+
+
+class ViewerPool:
+    def __init__(self, warm=1, max_open=2, start_timeout=60.0, viewer_args=()):
+        self.warm = warm
+        self.max_open = max_open
+        self.start_timeout = start_timeout
+        self.viewer_args = list(viewer_args)
+        self._authkey = secrets.token_bytes(16)
+        self._listener = None
+        self._workers = []
+        self._seq = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _start(self):
+        # Started on first use so servers that never open a viewer (or
+        # Flask's reloader parent) spawn no GUI processes.
+        self._listener = Listener(authkey=self._authkey)
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        print(f"Viewer pool listening on {self._listener.address}")
+
+    def _spawn(self):
+        cmd = [sys.executable, str(VIEWER_SCRIPT), "--worker", self._listener.address, *self.viewer_args]
+        env = {**os.environ, "VIEWER_AUTHKEY": self._authkey.hex()}
+        worker = _Worker(subprocess.Popen(cmd, env=env))
+        self._workers.append(worker)
+        return worker
+
+    def _top_up(self):
+        """Keep ``warm`` idle workers, within max_open + warm processes total."""
+        if self._closed:
+            return
+        idle = sum(1 for w in self._workers if w.scan_dir is None)
+        while idle < self.warm and len(self._workers) < self.max_open + self.warm:
+            self._spawn()
+            idle += 1
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+                hello = conn.recv()
+            except (OSError, EOFError):
+                continue
+            with self._lock:
+                worker = next((w for w in self._workers if w.proc.pid == hello.get("pid")), None)
+            if worker is None:
+                conn.close()
+                continue
+            worker.conn = conn
+            worker.ready.set()
+            threading.Thread(target=self._read_events, args=(worker,), daemon=True).start()
+
+    def _read_events(self, worker):
+        try:
+            while True:
+                event = worker.conn.recv()
+                print(f"Viewer {worker.proc.pid}: {event}")
+                if event["event"] in ("closed", "error"):
+                    with self._lock:
+                        if event.get("seq") == worker.seq:
+                            worker.scan_dir = None
+        except (EOFError, OSError):
+            pass
+        with self._lock:  # the worker exited: forget it and replace it
+            if worker in self._workers:
+                self._workers.remove(worker)
+            self._top_up()
+
+    def open(self, scan_dir, tumor_coords=None) -> dict:
+        """Show ``scan_dir`` in a viewer window. Raises ViewerLimit when
+        max_open windows are already showing other scans."""
+        with self._lock:
+            if self._closed:
+                raise ViewerLimit("Viewer pool is shut down")
+            if self._listener is None:
+                self._start()
+            self._workers = [w for w in self._workers if w.proc.poll() is None]
+            worker = next((w for w in self._workers if w.scan_dir == scan_dir), None)
+            reused = worker is not None
+            if worker is None:
+                if sum(1 for w in self._workers if w.scan_dir is not None) >= self.max_open:
+                    raise ViewerLimit(f"{self.max_open} viewers already open; close one first")
+                idle = [w for w in self._workers if w.scan_dir is None]
+                # Prefer a worker that has finished starting up.
+                worker = next((w for w in idle if w.ready.is_set()), None) or (idle[0] if idle else self._spawn())
+                worker.scan_dir = scan_dir
+            self._seq += 1
+            worker.seq = seq = self._seq
+            self._top_up()
+
+        if not worker.ready.wait(self.start_timeout):
+            with self._lock:
+                if worker.seq == seq:
+                    worker.scan_dir = None
+            raise TimeoutError(f"Viewer worker {worker.proc.pid} did not start in {self.start_timeout}s")
+        with self._lock:  # one writer per connection
+            worker.conn.send({"cmd": "open", "scan_dir": scan_dir, "tumor_coords": tumor_coords, "seq": seq})
+        return {"pid": worker.proc.pid, "reused": reused}
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            workers, self._workers = self._workers, []
+        for w in workers:
+            try:
+                if w.conn is not None:
+                    w.conn.send({"cmd": "quit"})
+            except OSError:
+                pass
+            try:
+                w.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                w.proc.kill()
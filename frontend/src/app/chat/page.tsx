@@ -16,7 +16,7 @@ import { Tabs, TabsList, TabsTrigger } from "@/components/ui/tabs";
 import { Spacer } from "@/components/ui/spacer";
 
 // New component for the DICOM viewer button
-const DicomViewerButton = () => {
+const DicomViewerButton = ({ timestamp }: { timestamp: string | null }) => {
   const [isLaunching, setIsLaunching] = useState(false);
   const [status, setStatus] = useState("");
   const { toast } = useToast();
@@ -33,7 +33,7 @@ const DicomViewerButton = () => {
         headers: {
           "Content-Type": "application/json",
         },
-        body: JSON.stringify({ scanDir: "scan" }),
+        body: JSON.stringify({ scanDir: "scan", timestamp }),
       });
 
       console.log(response);
@@ -100,24 +100,26 @@ export default function ChatPage() {
   const [response, setResponse] = useState<string>("");
   const [mriUrl, setMriUrl] = useState<string | null>(null);
   const [timestamp, setTimestamp] = useState<string | null>(null);
+  const [sessionId, setSessionId] = useState<string | null>(null);
   const { toast } = useToast();
   const router = useRouter();
 
   useEffect(() => {
-    const histItem = localStorage.getItem("selectedHistoryItem");
-    if (histItem) {
-      const parsed = JSON.parse(histItem);
-      setMriUrl(parsed.mri_url);
-      setTimestamp(parsed.timestamp);
-      return;
-    }
+    const stored =
+      localStorage.getItem("selectedHistoryItem") ??
+      localStorage.getItem("analysisResult");
+    if (!stored) return;
+    const ts: string = JSON.parse(stored).timestamp;
+    setTimestamp(ts);
 
-    const latestUpload = localStorage.getItem("analysisResult");
-    if (latestUpload) {
-      const parsed = JSON.parse(latestUpload);
-      setMriUrl(parsed.image_url);
-      setTimestamp(parsed.timestamp);
-    }
+    // Stored image URLs are presigned and expire; ask for a fresh one.
+    fetch(`http://localhost:5000/analysis/${ts}`)
+      .then((res) => {
+        if (!res.ok) throw new Error(`HTTP ${res.status}`);
+        return res.json();
+      })
+      .then((data) => setMriUrl(data.mri_url))
+      .catch((error) => console.error("Error fetching analysis:", error));
   }, []);
 
   const handleChatSubmit = async () => {
@@ -131,23 +133,56 @@ export default function ChatPage() {
     }
 
     try {
+      // Follow-up questions reuse one server-side session for this scan.
+      let sid = sessionId;
+      if (!sid) {
+        const sessionRes = await fetch("http://localhost:5000/chat/session", {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({ timestamp }),
+        });
+        if (!sessionRes.ok) throw new Error(`HTTP ${sessionRes.status}`);
+        sid = (await sessionRes.json()).session_id as string;
+        setSessionId(sid);
+      }
+
       const body = {
         prompt: prompt.trim(),
         timestamp,
+        session_id: sid,
       };
 
-      const res = await fetch("http://localhost:5000/chat", {
+      const res = await fetch("http://localhost:5000/chat/stream", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify(body),
       });
 
-      if (!res.ok) throw new Error(`HTTP ${res.status}`);
+      if (res.status === 404) {
+        setSessionId(null); // expired; the next submit opens a new session
+      }
 
-      const data = await res.json();
-      if (data.error) throw new Error(data.error);
+      if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
 
-      setResponse(data.response);
+      // Render tokens as they arrive: each SSE frame is "event?\ndata: {json}\n\n".
+      setResponse("");
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const frames = buffer.split("\n\n");
+        buffer = frames.pop() ?? "";
+        for (const frame of frames) {
+          const dataLine = frame.split("\n").find((l) => l.startsWith("data: "));
+          if (!dataLine) continue;
+          const data = JSON.parse(dataLine.slice(6));
+          if (frame.startsWith("event: error")) throw new Error(data.error);
+          if (data.text) setResponse((prev) => prev + data.text);
+        }
+      }
     } catch (err) {
       console.error("Chat error:", err);
       toast({
@@ -206,7 +241,7 @@ export default function ChatPage() {
         </p>
       )}
 
-      <DicomViewerButton />
+      <DicomViewerButton timestamp={timestamp} />
 
       {/* -------------------------- Chat card ------------------------------------------ */}
       <Card className="w-full max-w-2xl">
@@ -9,25 +9,30 @@ export default function HistoryPage() {
   const router = useRouter();
   const [historyItems, setHistoryItems] = useState<any[]>([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
 
-  useEffect(() => {
-    const fetchHistory = async () => {
-      try {
-        const res = await fetch('http://localhost:5000/history');
-        const data = await res.json();
-        setHistoryItems(data);
-      } catch (error) {
-        console.error('Error fetching history:', error);
-      } finally {
-        setLoading(false);
-      }
-    };
+  const fetchHistory = async (cursor: string | null = null) => {
+    try {
+      const params = new URLSearchParams({ limit: '20' });
+      if (cursor) params.set('cursor', cursor);
+      const res = await fetch(`http://localhost:5000/history?${params}`);
+      const data = await res.json();
+      setHistoryItems(prev => (cursor ? [...prev, ...data.items] : data.items));
+      setNextCursor(data.next_cursor);
+    } catch (error) {
+      console.error('Error fetching history:', error);
+    } finally {
+      setLoading(false);
+    }
+  };
 
+  useEffect(() => {
     fetchHistory();
   }, []);
 
   const handleHistoryClick = (item: any) => {
-    localStorage.setItem('selectedHistoryItem', JSON.stringify(item));
+    // Signed URLs expire; the chat page fetches a fresh one by timestamp.
+    localStorage.setItem('selectedHistoryItem', JSON.stringify({ timestamp: item.timestamp }));
     localStorage.setItem('currentTimestamp', item.timestamp);           // ④
     router.push('/chat');
   };
@@ -70,7 +75,7 @@ export default function HistoryPage() {
                 {/* Left: fixed-size image container */}
                 <div className="w-40 h-40 flex-shrink-0">
                   <img 
-                    src={item.mri_url} 
+                    src={item.thumbnail_url} 
                     alt="MRI" 
                     className="w-full h-full object-cover rounded-md shadow-md"
                   />
@@ -85,6 +90,14 @@ export default function HistoryPage() {
               </div>
             </div>
           ))}
+          {nextCursor && (
+            <button
+              className="self-center border px-4 py-2 rounded-md hover:bg-gray-100"
+              onClick={() => fetchHistory(nextCursor)}
+            >
+              Load more
+            </button>
+          )}
         </div>
       )}
 